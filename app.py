@@ -21,6 +21,7 @@ from webhooks.kirvano import kirvano_bp
 from webhooks.hubla import hubla_bp
 from webhooks.braip import braip_bp
 from webhooks.cakto import cakto_bp
+from webhooks._buffer import queue_status
 
 # ==================== ALTERAÇÃO 1: IMPORT DO BLUEPRINT DE EXPORTAÇÃO ====================
 from export_excel import export_bp
@@ -45,6 +46,12 @@ app.register_blueprint(cakto_bp, url_prefix="/webhook/cakto")
 app.register_blueprint(export_bp, url_prefix="/api/export")
 
 
+@app.route("/health")
+def health():
+    """Health check com a profundidade da fila de gravação dos webhooks deste worker"""
+    return jsonify({"status": "ok", "webhook_queue": queue_status()})
+
+
 @app.route("/")
 @app.route("/dashboard")
 def dashboard_page():
@@ -65,8 +72,7 @@ def get_dashboard_data():
         end_date_dt = datetime.strptime(end_date_str, '%Y-%m-%d').replace(hour=23, minute=59, second=59)
 
         # 2. Conexão e execução das queries no banco de dados
-        conn = get_db_connection()
-        with conn.cursor() as cursor:
+        with get_db_connection(readonly=True) as conn, conn.cursor() as cursor:
             base_where_clause = "WHERE created_at BETWEEN %s AND %s"
             params = [start_date_str, end_date_dt]
 
@@ -114,8 +120,6 @@ def get_dashboard_data():
             # Query para produtos com mais abandonos
             cursor.execute(f"SELECT product_name, COUNT(*) as count FROM webhooks {base_where_clause} AND product_name IS NOT NULL AND product_name != '' AND {abandon_events_filter} GROUP BY product_name ORDER BY count DESC LIMIT %s", tuple(params + [top_n]))
             top_abandoned_products = cursor.fetchall()
-            
-        conn.close()
 
         # 3. Processamento e formatação dos dados para a resposta JSON
         date_range_days = (end_date_dt - datetime.strptime(start_date_str, '%Y-%m-%d')).days + 1
@@ -328,8 +332,7 @@ def export_pdf_api():
             
             # Buscar dados de abandonos no banco
             try:
-                conn = get_db_connection()
-                with conn.cursor() as cursor:
+                with get_db_connection(readonly=True) as conn, conn.cursor() as cursor:
                     abandon_events_filter = """(
                         (platform = 'kirvano' AND event_type = 'ABANDONED_CART') OR 
                         (platform = 'hubla' AND event_type = 'CanceledSale') OR 
@@ -347,7 +350,6 @@ def export_pdf_api():
                     cursor.execute(query, (start_date_obj, end_date_obj_for_query))
                     abandoned_details = cursor.fetchall()
                     
-                conn.close()
                 logger.info(f"📋 Encontrados {len(abandoned_details)} abandonos")
                 
             except Exception as db_error:
@@ -1,14 +1,18 @@
 import os
 import json
+import orjson
 import psycopg2
-from psycopg2 import sql
+from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
 from dotenv import load_dotenv
 from io import StringIO, BytesIO
-import csv
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from functools import wraps
 import time
 
@@ -32,10 +36,193 @@ def retry_on_failure(max_retries=3, delay=1):
         return wrapper
     return decorator
 
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Obtém o pool de conexões do processo (criado sob demanda, após o fork do gunicorn)"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadedConnectionPool(
+                    minconn=int(os.getenv("DB_POOL_MIN", 2)),
+                    maxconn=int(os.getenv("DB_POOL_MAX", 20)),
+                    dsn=os.getenv("DATABASE_URL"),
+                    application_name=os.getenv("PGAPPNAME", "export_worker"),
+                    options=f"-c statement_timeout={os.getenv('DB_STATEMENT_TIMEOUT_MS', 60000)}",
+                    # Keepalive TCP: conexões ociosas no pool não caem silenciosamente por NAT/firewall
+                    keepalives=1,
+                    keepalives_idle=30,
+                    keepalives_interval=10,
+                    keepalives_count=3
+                )
+    return _pool
+
 @retry_on_failure()
-def get_db_connection():
-    """Obtém conexão com o banco de dados com retry automático"""
-    return psycopg2.connect(os.getenv("DATABASE_URL"))
+def _emprestar_conexao():
+    pool = get_pool()
+    conn = pool.getconn()
+    if conn.closed:
+        # Conexão derrubada pelo servidor enquanto ociosa: descartar e abrir outra
+        pool.putconn(conn, close=True)
+        conn = pool.getconn()
+    return conn
+
+@contextmanager
+def get_db_connection(readonly=False):
+    """
+    Empresta uma conexão do pool com retry automático e a devolve ao sair do bloco
+    
+    Args:
+        readonly: Se True, usa autocommit para evitar os round-trips de BEGIN/ROLLBACK
+                  em consultas que apenas leem dados
+    """
+    conn = _emprestar_conexao()
+    try:
+        if readonly:
+            conn.autocommit = True
+        yield conn
+    finally:
+        # Devolver a conexão no estado padrão; transações pendentes são desfeitas pelo pool
+        if not conn.closed and conn.autocommit:
+            conn.autocommit = False
+        get_pool().putconn(conn)
+
+# Migrações idempotentes para bancos criados antes delas: o init.sql só roda
+# quando o volume do Postgres é criado
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+# Advisory locks que serializam migrações e o REFRESH da view entre workers e instâncias
+_MIGRATIONS_LOCK_ID = 7_310_001
+_STATS_LOCK_ID = 7_310_002
+
+_migracoes_aplicadas = False
+_migracoes_lock = threading.Lock()
+
+# Arquivos com esta linha rodam fora de transação, um comando por vez: exigido por
+# CREATE/DROP INDEX CONCURRENTLY, que não bloqueia os INSERTs dos webhooks
+_MARCA_AUTOCOMMIT = '-- migracao: autocommit'
+
+def _comandos_sql(conteudo):
+    """Separa um arquivo .sql em comandos, descartando as linhas de comentário"""
+    sem_comentarios = "\n".join(
+        linha for linha in conteudo.splitlines() if not linha.lstrip().startswith('--')
+    )
+    return [comando.strip() for comando in sem_comentarios.split(';') if comando.strip()]
+
+def aplicar_migracoes():
+    """
+    Aplica os arquivos .sql de migrations/ em ordem, uma vez por processo
+    
+    Os arquivos comuns rodam numa única transação sob advisory lock, então workers
+    iniciando juntos não disputam os mesmos CREATE ... IF NOT EXISTS. Em seguida, os
+    marcados com _MARCA_AUTOCOMMIT rodam em autocommit, comando a comando, sob o
+    mesmo lock (em nível de sessão).
+    """
+    global _migracoes_aplicadas
+    if _migracoes_aplicadas:
+        return
+    with _migracoes_lock:
+        if _migracoes_aplicadas:
+            return
+        arquivos = sorted(f for f in os.listdir(MIGRATIONS_DIR) if f.endswith('.sql'))
+        transacionais, autocommit = [], []
+        for arquivo in arquivos:
+            with open(os.path.join(MIGRATIONS_DIR, arquivo), encoding='utf-8') as f:
+                conteudo = f.read()
+            if _MARCA_AUTOCOMMIT in conteudo.splitlines():
+                autocommit.append(conteudo)
+            else:
+                transacionais.append(conteudo)
+        
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_xact_lock(%s)", (_MIGRATIONS_LOCK_ID,))
+                for conteudo in transacionais:
+                    cursor.execute(conteudo)
+            conn.commit()
+            
+            if autocommit:
+                conn.autocommit = True
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT pg_advisory_lock(%s)", (_MIGRATIONS_LOCK_ID,))
+                    try:
+                        for conteudo in autocommit:
+                            for comando in _comandos_sql(conteudo):
+                                cursor.execute(comando)
+                    finally:
+                        cursor.execute("SELECT pg_advisory_unlock(%s)", (_MIGRATIONS_LOCK_ID,))
+        _migracoes_aplicadas = True
+        logger.info(f"✅ Migrações aplicadas: {', '.join(arquivos)}")
+
+def explicar_consulta(cursor, query, params=None):
+    """Registra o plano de execução da consulta (apenas em desenvolvimento)"""
+    if os.getenv('FLASK_ENV') != 'development':
+        return
+    try:
+        cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS) {query}", params)
+        plano = "\n".join(row[0] for row in cursor.fetchall())
+        logger.info(f"🔎 Plano de execução:\n{plano}")
+    except Exception as e:
+        logger.warning(f"⚠️ Não foi possível obter o plano de execução: {e}")
+        cursor.connection.rollback()
+
+# NUMERIC convertido direto para float no cursor: o DataFrame já nasce float64,
+# sem objetos Decimal nem um pd.to_numeric posterior
+DECIMAL_PARA_FLOAT = psycopg2.extensions.new_type(
+    psycopg2.extensions.DECIMAL.values,
+    'DECIMAL_PARA_FLOAT',
+    lambda valor, cursor: float(valor) if valor is not None else None
+)
+
+def consultar_em_lotes(query, params=None, itersize=10000, explicar=False):
+    """
+    Executa uma consulta grande com cursor no servidor (named cursor)
+    
+    As linhas chegam em lotes de `itersize` em vez de serem todas bufferizadas
+    pela libpq de uma vez. O cursor nomeado exige transação, por isso a conexão
+    não usa autocommit; o pool desfaz a transação ao recebê-la de volta.
+    Valores NUMERIC chegam como float (DECIMAL_PARA_FLOAT), prontos para o DataFrame.
+    
+    Returns:
+        tuple: (colunas, linhas)
+    """
+    with get_db_connection() as conn:
+        if explicar:
+            with conn.cursor() as cursor:
+                explicar_consulta(cursor, query, params)
+        with conn.cursor(name='webhooks_stream') as cursor:
+            psycopg2.extensions.register_type(DECIMAL_PARA_FLOAT, cursor)
+            cursor.itersize = itersize
+            cursor.execute(query, params)
+            rows = list(cursor)
+            columns = [desc[0] for desc in cursor.description] if cursor.description else []
+    return columns, rows
+
+def iterar_em_lotes(query, params=None, tamanho_lote=50000):
+    """
+    Percorre uma consulta grande em lotes com cursor no servidor, sem materializar o resultado
+    
+    Cada lote de até `tamanho_lote` linhas (fetchmany) é entregue e pode ser descartado
+    antes do próximo. A conexão fica emprestada até o gerador terminar ou ser fechado.
+    
+    Yields:
+        tuple: (colunas, linhas) de cada lote
+    """
+    with get_db_connection() as conn:
+        with conn.cursor(name='webhooks_stream_lotes') as cursor:
+            psycopg2.extensions.register_type(DECIMAL_PARA_FLOAT, cursor)
+            cursor.itersize = tamanho_lote
+            cursor.execute(query, params)
+            columns = None
+            while True:
+                rows = cursor.fetchmany(tamanho_lote)
+                if not rows:
+                    break
+                if columns is None:
+                    columns = [desc[0] for desc in cursor.description]
+                yield columns, rows
 
 def safe_float(value, default=None):
     """Converte valor para float com segurança"""
@@ -61,69 +248,157 @@ def safe_int(value, default=0):
     except (ValueError, TypeError):
         return default
 
-@retry_on_failure()
-def salvar_evento(plataforma, tipo, payload):
-    """
-    Salva evento no banco de dados com tratamento adequado de tipos
-    """
-    insert_sql = sql.SQL("""
-    INSERT INTO webhooks (
+_COLUNAS_EVENTO = """
         platform, event_type, webhook_id, customer_email, customer_name,
         customer_document, product_name, product_id, transaction_id,
         amount, currency, payment_method, status, commission_amount,
         affiliate_email, utm_source, utm_medium, sales_link, 
         attendant_name, attendant_email, raw_data, created_at
-    ) VALUES (
-        %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
-        %s, %s, %s, %s, %s, %s, %s, NOW()
+"""
+
+# Placeholders de uma linha de evento; created_at fica a cargo do banco
+_VALORES_EVENTO = "(" + ", ".join(["%s"] * 21) + ", NOW())"
+
+def _linha_evento(plataforma, tipo, payload):
+    """Converte o payload padronizado na tupla de parâmetros do INSERT em webhooks"""
+    # Garante que raw_data seja sempre uma string
+    if 'raw_data' in payload and isinstance(payload['raw_data'], str):
+        raw_data = payload['raw_data']
+    else:
+        # Se raw_data não existir ou não for string, converte todo o payload
+        raw_data = json.dumps(payload, ensure_ascii=False, default=str)
+    
+    return (
+        plataforma, 
+        tipo,
+        safe_str(payload.get('webhook_id')),
+        safe_str(payload.get('customer_email')),
+        safe_str(payload.get('customer_name')),
+        safe_str(payload.get('customer_document')),
+        safe_str(payload.get('product_name')),
+        safe_str(payload.get('product_id')),
+        safe_str(payload.get('transaction_id')),
+        safe_float(payload.get('amount')),
+        safe_str(payload.get('currency')),
+        safe_str(payload.get('payment_method')),
+        safe_str(payload.get('status')),
+        safe_float(payload.get('commission_amount')),
+        safe_str(payload.get('affiliate_email')),
+        safe_str(payload.get('utm_source')),
+        safe_str(payload.get('utm_medium')),
+        safe_str(payload.get('sales_link')),
+        safe_str(payload.get('attendant_name')),
+        safe_str(payload.get('attendant_email')),
+        raw_data
     )
-    """)
+
+# INSERT de um evento preparado uma vez por sessão do Postgres (PREPARE/EXECUTE):
+# o servidor não refaz parse e planejamento a cada webhook salvo individualmente
+_INSERT_PREPARADO = "webhook_insert"
+_EXECUTE_EVENTO = f"EXECUTE {_INSERT_PREPARADO} (" + ", ".join(["%s"] * 21) + ")"
+
+# PIDs dos backends que já têm o INSERT preparado (a conexão do psycopg2 não aceita weakref)
+_sessoes_preparadas = set()
+
+def _preparar_insert(conn, cursor):
+    """Garante o INSERT preparado na sessão da conexão (uma consulta extra na primeira vez)"""
+    pid = conn.get_backend_pid()
+    if pid in _sessoes_preparadas:
+        return pid
     
-    conn = None
+    cursor.execute("SELECT 1 FROM pg_prepared_statements WHERE name = %s", (_INSERT_PREPARADO,))
+    if cursor.fetchone() is None:
+        parametros = ", ".join(f"${i}" for i in range(1, 22))
+        cursor.execute(
+            f"PREPARE {_INSERT_PREPARADO} AS "
+            f"INSERT INTO webhooks ({_COLUNAS_EVENTO}) VALUES ({parametros}, NOW())"
+        )
+    _sessoes_preparadas.add(pid)
+    return pid
+
+def _executar_insert(conn, cursor, linha):
+    """
+    Executa o INSERT preparado, preparando-o de novo se a sessão não o tiver
+    
+    Um PID reaproveitado pelo Postgres (conexão substituída no pool) pode estar em
+    _sessoes_preparadas sem o PREPARE na sessão nova: refaz na mesma tentativa, sem
+    passar pelo retry nem registrar o evento (válido) como erro.
+    """
+    pid = _preparar_insert(conn, cursor)
     try:
-        # Garante que raw_data seja sempre uma string
-        if 'raw_data' in payload and isinstance(payload['raw_data'], str):
-            raw_data = payload['raw_data']
-        else:
-            # Se raw_data não existir ou não for string, converte todo o payload
-            raw_data = json.dumps(payload, ensure_ascii=False, default=str)
-        
-        conn = get_db_connection()
-        with conn.cursor() as cursor:
-            cursor.execute(insert_sql, (
-                plataforma, 
-                tipo,
-                safe_str(payload.get('webhook_id')),
-                safe_str(payload.get('customer_email')),
-                safe_str(payload.get('customer_name')),
-                safe_str(payload.get('customer_document')),
-                safe_str(payload.get('product_name')),
-                safe_str(payload.get('product_id')),
-                safe_str(payload.get('transaction_id')),
-                safe_float(payload.get('amount')),
-                safe_str(payload.get('currency')),
-                safe_str(payload.get('payment_method')),
-                safe_str(payload.get('status')),
-                safe_float(payload.get('commission_amount')),
-                safe_str(payload.get('affiliate_email')),
-                safe_str(payload.get('utm_source')),
-                safe_str(payload.get('utm_medium')),
-                safe_str(payload.get('sales_link')),
-                safe_str(payload.get('attendant_name')),
-                safe_str(payload.get('attendant_email')),
-                raw_data
-            ))
-        conn.commit()
-        logger.info(f"✅ Evento salvo: {plataforma} - {tipo}")
+        try:
+            cursor.execute(_EXECUTE_EVENTO, linha)
+        except psycopg2.errors.InvalidSqlStatementName:
+            # PREPARE não é transacional: o rollback só limpa a transação abortada
+            conn.rollback()
+            _sessoes_preparadas.discard(pid)
+            pid = _preparar_insert(conn, cursor)
+            cursor.execute(_EXECUTE_EVENTO, linha)
+    except Exception:
+        # Estado da sessão incerto: verificar o PREPARE de novo na próxima vez
+        _sessoes_preparadas.discard(pid)
+        raise
+
+@retry_on_failure()
+def salvar_evento(plataforma, tipo, payload):
+    """
+    Salva evento no banco de dados com tratamento adequado de tipos
+    
+    Só levanta exceção até o commit(): depois dele o evento está gravado e uma falha
+    ao devolver a conexão não pode provocar nova tentativa (evento duplicado).
+    """
+    gravado = False
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                _executar_insert(conn, cursor, _linha_evento(plataforma, tipo, payload))
+            conn.commit()
+            gravado = True
     except Exception as e:
+        if gravado:
+            logger.warning(f"⚠️ Evento salvo, mas houve erro ao liberar a conexão: {e}")
+            return
         logger.error(f"❌ Erro ao inserir evento: {e}")
         logger.error(f"Payload problemático: {payload}")
-        if conn:
-            conn.rollback()
         raise
-    finally:
-        if conn:
-            conn.close()
+    logger.info(f"✅ Evento salvo: {plataforma} - {tipo}")
+
+@retry_on_failure()
+def salvar_eventos_lote(eventos):
+    """
+    Salva vários eventos com um único INSERT multi-linha (execute_values)
+    
+    Só levanta exceção até o commit(), como salvar_evento: quem trata o erro pode
+    regravar os eventos sem risco de duplicá-los.
+    
+    Args:
+        eventos: Lista de tuplas (plataforma, tipo, payload)
+    """
+    if not eventos:
+        return
+    
+    linhas = [_linha_evento(plataforma, tipo, payload) for plataforma, tipo, payload in eventos]
+    
+    gravado = False
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                execute_values(
+                    cursor,
+                    f"INSERT INTO webhooks ({_COLUNAS_EVENTO}) VALUES %s",
+                    linhas,
+                    template=_VALORES_EVENTO,
+                    page_size=len(linhas)
+                )
+            conn.commit()
+            gravado = True
+    except Exception as e:
+        if gravado:
+            logger.warning(f"⚠️ Lote de {len(linhas)} eventos salvo, mas houve erro ao liberar a conexão: {e}")
+            return
+        logger.error(f"❌ Erro ao inserir lote de {len(linhas)} eventos: {e}")
+        raise
+    logger.info(f"✅ Lote de {len(linhas)} eventos salvo")
 
 @retry_on_failure()
 def obter_estatisticas_gerais(start_date=None, end_date=None, platform=None):
@@ -155,32 +430,125 @@ def obter_estatisticas_gerais(start_date=None, end_date=None, platform=None):
         query += " AND platform = %s"
         params.append(platform)
     
-    conn = None
     try:
-        conn = get_db_connection()
-        with conn.cursor() as cursor:
-            cursor.execute(query, params)
-            result = cursor.fetchone()
+        with get_db_connection(readonly=True) as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(query, params)
+                result = cursor.fetchone()
             
-            if result:
-                return {
-                    'total_events': result[0],
-                    'platforms_count': result[1],
-                    'unique_customers': result[2],
-                    'unique_products': result[3],
-                    'total_revenue': float(result[4] or 0),
-                    'avg_transaction': float(result[5] or 0),
-                    'first_event': result[6],
-                    'last_event': result[7]
-                }
-            return None
+                if result:
+                    return {
+                        'total_events': result[0],
+                        'platforms_count': result[1],
+                        'unique_customers': result[2],
+                        'unique_products': result[3],
+                        'total_revenue': float(result[4] or 0),
+                        'avg_transaction': float(result[5] or 0),
+                        'first_event': result[6],
+                        'last_event': result[7]
+                    }
+                return None
             
     except Exception as e:
         logger.error(f"Erro ao obter estatísticas gerais: {e}")
         raise
-    finally:
-        if conn:
-            conn.close()
+
+@retry_on_failure()
+def obter_estatisticas_rapidas():
+    """
+    Obtém as estatísticas rápidas a partir da materialized view webhook_stats_24h
+    """
+    try:
+        with get_db_connection(readonly=True) as conn:
+            with conn.cursor() as cursor:
+                try:
+                    cursor.execute("""
+                        SELECT total_webhooks, platforms, oldest_record, newest_record,
+                               events_24h, revenue_24h, refreshed_at
+                        FROM webhook_stats_24h
+                    """)
+                except psycopg2.errors.UndefinedTable:
+                    # View ainda não criada (init.sql antigo): calcular direto na tabela
+                    logger.warning("⚠️ webhook_stats_24h não existe, calculando estatísticas na tabela")
+                    conn.rollback()
+                    cursor.execute("""
+                        SELECT
+                            COUNT(*),
+                            COUNT(DISTINCT platform),
+                            MIN(created_at),
+                            MAX(created_at),
+                            COUNT(*) FILTER (WHERE created_at >= NOW() - INTERVAL '24 hours'),
+                            COALESCE(SUM(amount) FILTER (WHERE created_at >= NOW() - INTERVAL '24 hours'), 0),
+                            NOW()
+                        FROM webhooks
+                    """)
+                result = cursor.fetchone()
+
+                if result:
+                    return {
+                        'total_webhooks': result[0],
+                        'platforms': result[1],
+                        'oldest_record': result[2],
+                        'newest_record': result[3],
+                        'events_24h': result[4],
+                        'revenue_24h': float(result[5] or 0),
+                        'refreshed_at': result[6]
+                    }
+                return None
+
+    except Exception as e:
+        logger.error(f"Erro ao obter estatísticas rápidas: {e}")
+        raise
+
+_stats_snapshot = None
+_stats_refresher = None
+_stats_refresher_lock = threading.Lock()
+
+def _atualizar_snapshot_estatisticas(intervalo, idade_maxima_view):
+    """Atualiza a view (se vencida) e recalcula o snapshot a cada `intervalo` segundos"""
+    global _stats_snapshot
+    try:
+        aplicar_migracoes()
+    except Exception as e:
+        logger.warning(f"⚠️ Falha ao aplicar migrações: {e}")
+    
+    while True:
+        try:
+            atualizar_estatisticas_rapidas(idade_maxima=idade_maxima_view)
+        except Exception as e:
+            logger.warning(f"⚠️ Falha ao atualizar webhook_stats_24h: {e}")
+        try:
+            _stats_snapshot = obter_estatisticas_rapidas()
+        except Exception as e:
+            logger.warning(f"⚠️ Falha ao atualizar snapshot de estatísticas: {e}")
+        time.sleep(intervalo)
+
+def obter_snapshot_estatisticas():
+    """
+    Retorna as estatísticas rápidas mantidas por uma thread em segundo plano
+    
+    A thread é iniciada na primeira chamada (já no worker, após o fork do gunicorn),
+    atualiza a view webhook_stats_24h quando ela tem mais de STATS_VIEW_MAX_AGE_SECONDS
+    e recalcula o snapshot a cada STATS_REFRESH_SECONDS; as requisições só leem o
+    último valor, sem esperar pelo banco.
+    """
+    global _stats_refresher
+    if _stats_refresher is None:
+        with _stats_refresher_lock:
+            if _stats_refresher is None:
+                _stats_refresher = threading.Thread(
+                    target=_atualizar_snapshot_estatisticas,
+                    args=(
+                        int(os.getenv("STATS_REFRESH_SECONDS", 60)),
+                        int(os.getenv("STATS_VIEW_MAX_AGE_SECONDS", 300))
+                    ),
+                    name="stats_refresher",
+                    daemon=True
+                )
+                _stats_refresher.start()
+    
+    # Antes do primeiro ciclo da thread, ler a view na hora
+    return _stats_snapshot or obter_estatisticas_rapidas()
 
 @retry_on_failure()
 def analisar_performance_produtos(start_date=None, end_date=None, limit=20):
@@ -216,39 +584,35 @@ def analisar_performance_produtos(start_date=None, end_date=None, limit=20):
     """
     params.append(limit)
     
-    conn = None
     try:
-        conn = get_db_connection()
-        with conn.cursor() as cursor:
-            cursor.execute(query, params)
-            results = cursor.fetchall()
+        with get_db_connection(readonly=True) as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(query, params)
+                results = cursor.fetchall()
             
-            products_analysis = []
-            for row in results:
-                conversion_rate = (row[2] / row[1] * 100) if row[1] > 0 else 0
-                abandon_rate = (row[3] / row[1] * 100) if row[1] > 0 else 0
+                products_analysis = []
+                for row in results:
+                    conversion_rate = (row[2] / row[1] * 100) if row[1] > 0 else 0
+                    abandon_rate = (row[3] / row[1] * 100) if row[1] > 0 else 0
                 
-                products_analysis.append({
-                    'product_name': row[0],
-                    'total_events': row[1],
-                    'sales': row[2],
-                    'abandons': row[3],
-                    'revenue': float(row[4] or 0),
-                    'avg_price': float(row[5] or 0),
-                    'unique_customers': row[6],
-                    'platforms_used': row[7],
-                    'conversion_rate': round(conversion_rate, 2),
-                    'abandon_rate': round(abandon_rate, 2)
-                })
+                    products_analysis.append({
+                        'product_name': row[0],
+                        'total_events': row[1],
+                        'sales': row[2],
+                        'abandons': row[3],
+                        'revenue': float(row[4] or 0),
+                        'avg_price': float(row[5] or 0),
+                        'unique_customers': row[6],
+                        'platforms_used': row[7],
+                        'conversion_rate': round(conversion_rate, 2),
+                        'abandon_rate': round(abandon_rate, 2)
+                    })
             
-            return products_analysis
+                return products_analysis
             
     except Exception as e:
         logger.error(f"Erro na análise de performance de produtos: {e}")
         raise
-    finally:
-        if conn:
-            conn.close()
 
 @retry_on_failure()
 def analisar_cohort_clientes(start_date=None, end_date=None):
@@ -294,32 +658,28 @@ def analisar_cohort_clientes(start_date=None, end_date=None):
     SELECT * FROM cohort_data
     """
     
-    conn = None
     try:
-        conn = get_db_connection()
-        with conn.cursor() as cursor:
-            cursor.execute(query, params)
-            results = cursor.fetchall()
+        with get_db_connection(readonly=True) as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(query, params)
+                results = cursor.fetchall()
             
-            cohort_analysis = []
-            for row in results:
-                cohort_analysis.append({
-                    'date': row[0].strftime('%Y-%m-%d'),
-                    'customers_count': row[1],
-                    'total_purchases': row[2],
-                    'avg_purchases_per_customer': float(row[3] or 0),
-                    'total_revenue': float(row[4] or 0),
-                    'avg_ltv': float(row[5] or 0)
-                })
+                cohort_analysis = []
+                for row in results:
+                    cohort_analysis.append({
+                        'date': row[0].strftime('%Y-%m-%d'),
+                        'customers_count': row[1],
+                        'total_purchases': row[2],
+                        'avg_purchases_per_customer': float(row[3] or 0),
+                        'total_revenue': float(row[4] or 0),
+                        'avg_ltv': float(row[5] or 0)
+                    })
             
-            return cohort_analysis
+                return cohort_analysis
             
     except Exception as e:
         logger.error(f"Erro na análise de cohort: {e}")
         raise
-    finally:
-        if conn:
-            conn.close()
 
 @retry_on_failure()
 def detectar_anomalias_vendas():
@@ -339,57 +699,53 @@ def detectar_anomalias_vendas():
     ORDER BY date
     """
     
-    conn = None
     try:
-        conn = get_db_connection()
-        with conn.cursor() as cursor:
-            cursor.execute(query)
-            results = cursor.fetchall()
+        with get_db_connection(readonly=True) as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(query)
+                results = cursor.fetchall()
             
-            if len(results) < 7:  # Precisa de pelo menos 7 dias de dados
-                return []
+                if len(results) < 7:  # Precisa de pelo menos 7 dias de dados
+                    return []
             
-            # Converter para DataFrame para análise
-            df = pd.DataFrame(results, columns=['date', 'sales_count', 'daily_revenue'])
-            df['daily_revenue'] = df['daily_revenue'].astype(float)
+                # Converter para DataFrame para análise
+                df = pd.DataFrame(results, columns=['date', 'sales_count', 'daily_revenue'])
+                df['daily_revenue'] = df['daily_revenue'].astype(float)
             
-            # Calcular estatísticas
-            revenue_mean = df['daily_revenue'].mean()
-            revenue_std = df['daily_revenue'].std()
-            sales_mean = df['sales_count'].mean()
-            sales_std = df['sales_count'].std()
+                # Calcular estatísticas
+                revenue_mean = df['daily_revenue'].mean()
+                revenue_std = df['daily_revenue'].std()
+                sales_mean = df['sales_count'].mean()
+                sales_std = df['sales_count'].std()
             
-            # Detectar anomalias (valores > 2 desvios padrão)
-            anomalies = []
-            for _, row in df.iterrows():
-                revenue_z_score = abs((row['daily_revenue'] - revenue_mean) / revenue_std) if revenue_std > 0 else 0
-                sales_z_score = abs((row['sales_count'] - sales_mean) / sales_std) if sales_std > 0 else 0
+                # Detectar anomalias (valores > 2 desvios padrão)
+                anomalies = []
+                for _, row in df.iterrows():
+                    revenue_z_score = abs((row['daily_revenue'] - revenue_mean) / revenue_std) if revenue_std > 0 else 0
+                    sales_z_score = abs((row['sales_count'] - sales_mean) / sales_std) if sales_std > 0 else 0
                 
-                if revenue_z_score > 2 or sales_z_score > 2:
-                    anomaly_type = []
-                    if revenue_z_score > 2:
-                        anomaly_type.append('revenue')
-                    if sales_z_score > 2:
-                        anomaly_type.append('sales')
+                    if revenue_z_score > 2 or sales_z_score > 2:
+                        anomaly_type = []
+                        if revenue_z_score > 2:
+                            anomaly_type.append('revenue')
+                        if sales_z_score > 2:
+                            anomaly_type.append('sales')
                     
-                    anomalies.append({
-                        'date': row['date'].strftime('%Y-%m-%d'),
-                        'sales_count': row['sales_count'],
-                        'daily_revenue': row['daily_revenue'],
-                        'revenue_z_score': round(revenue_z_score, 2),
-                        'sales_z_score': round(sales_z_score, 2),
-                        'anomaly_type': anomaly_type,
-                        'severity': 'high' if max(revenue_z_score, sales_z_score) > 3 else 'medium'
-                    })
+                        anomalies.append({
+                            'date': row['date'].strftime('%Y-%m-%d'),
+                            'sales_count': row['sales_count'],
+                            'daily_revenue': row['daily_revenue'],
+                            'revenue_z_score': round(revenue_z_score, 2),
+                            'sales_z_score': round(sales_z_score, 2),
+                            'anomaly_type': anomaly_type,
+                            'severity': 'high' if max(revenue_z_score, sales_z_score) > 3 else 'medium'
+                        })
             
-            return anomalies
+                return anomalies
             
     except Exception as e:
         logger.error(f"Erro na detecção de anomalias: {e}")
         raise
-    finally:
-        if conn:
-            conn.close()
 
 @retry_on_failure()
 def exportar_csv(plataforma=None, start_date=None, end_date=None):
@@ -427,35 +783,49 @@ def exportar_csv(plataforma=None, start_date=None, end_date=None):
     
     query += " ORDER BY created_at DESC"
     
-    conn = None
     try:
-        conn = get_db_connection()
-        with conn.cursor() as cursor:
-            cursor.execute(query, params)
-            
-            # Criar CSV
-            output = StringIO()
-            writer = csv.writer(output)
-            
-            # Header com colunas adicionais
-            headers = [desc[0] for desc in cursor.description]
-            writer.writerow(headers)
-            
-            # Dados
-            writer.writerows(cursor.fetchall())
-            
-            return output.getvalue()
+        with get_db_connection(readonly=True) as conn:
+            with conn.cursor() as cursor:
+                # O próprio Postgres gera o CSV via COPY, sem converter linha a linha em Python
+                copy_sql = f"COPY ({cursor.mogrify(query, params).decode()}) TO STDOUT WITH (FORMAT CSV, HEADER TRUE)"
+                
+                output = StringIO()
+                cursor.copy_expert(copy_sql, output)
+                
+                return output.getvalue()
             
     except Exception as e:
         logger.error(f"Erro ao exportar CSV: {e}")
         raise
-    finally:
-        if conn:
-            conn.close()
 
-def exportar_xlsx(plataforma=None, start_date=None, end_date=None):
+# Colunas monetárias das abas do exportar_xlsx
+MONEY_COLUMNS = {'amount', 'total_revenue', 'avg_transaction', 'revenue', 'avg_price', 'avg_ltv'}
+
+def _serializar_json(valor):
+    """Serializa dict/list em texto JSON para caber em uma célula do Excel"""
+    if isinstance(valor, (dict, list)):
+        return orjson.dumps(valor, default=str, option=orjson.OPT_NON_STR_KEYS).decode()
+    return valor
+
+def _achatar_raw_data(raw_values, ignorar=()):
+    """
+    Expande as chaves de primeiro nível do raw_data em colunas (dict coluna -> valores).
+    Valores aninhados são mantidos como texto JSON; chaves em `ignorar` são descartadas.
+    """
+    parsed = [
+        valor if isinstance(valor, dict) else (orjson.loads(valor) if valor else {})
+        for valor in raw_values
+    ]
+    # União das chaves calculada uma única vez, preservando a ordem de aparição
+    keys = [key for key in dict.fromkeys(key for item in parsed for key in item) if key not in ignorar]
+    return {key: [_serializar_json(item.get(key)) for item in parsed] for key in keys}
+
+def exportar_xlsx(plataforma=None, start_date=None, end_date=None, flatten_raw_data=False):
     """
     Exporta dados do banco para arquivo Excel (XLSX) com múltiplas abas e análises
+    
+    Por padrão o raw_data é gravado como texto JSON em uma única coluna;
+    com flatten_raw_data=True as chaves de primeiro nível viram colunas.
     """
     query_main = """
     SELECT 
@@ -479,60 +849,62 @@ def exportar_xlsx(plataforma=None, start_date=None, end_date=None):
     
     query_main += " ORDER BY created_at DESC"
     
-    conn = None
     try:
-        conn = get_db_connection()
-        
-        # Obter dados principais
-        with conn.cursor() as cursor:
-            cursor.execute(query_main, params)
-            columns = [desc[0] for desc in cursor.description]
-            rows = cursor.fetchall()
-        
-        # Converter para DataFrame
-        df_main = pd.DataFrame(rows, columns=columns)
-        
-        # Processar o raw_data (JSON) para colunas separadas
-        if 'raw_data' in df_main.columns and len(df_main) > 0:
-            df_main['raw_data'] = df_main['raw_data'].apply(
-                lambda x: json.loads(x) if x and isinstance(x, str) else {}
-            )
-            raw_data_df = pd.json_normalize(df_main['raw_data'])
-            df_main = pd.concat([df_main.drop('raw_data', axis=1), raw_data_df], axis=1)
-        
-        # Obter análises adicionais
-        stats = obter_estatisticas_gerais(start_date, end_date, plataforma)
-        products_analysis = analisar_performance_produtos(start_date, end_date)
-        cohort_analysis = analisar_cohort_clientes(start_date, end_date)
-        
+        # Disparar as análises adicionais em paralelo (cada uma com sua conexão do pool)
+        # enquanto os dados principais são buscados e processados nesta thread
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            stats_future = executor.submit(obter_estatisticas_gerais, start_date, end_date, plataforma)
+            products_future = executor.submit(analisar_performance_produtos, start_date, end_date)
+            cohort_future = executor.submit(analisar_cohort_clientes, start_date, end_date)
+            
+            # Obter dados principais
+            columns, rows = consultar_em_lotes(query_main, params)
+
+            # Converter para DataFrame
+            df_main = pd.DataFrame(rows, columns=columns)
+
+            # Processar o raw_data (JSON): texto único por padrão, colunas separadas sob demanda
+            if 'raw_data' in df_main.columns and len(df_main) > 0:
+                if flatten_raw_data:
+                    # Montar o DataFrame final em uma única alocação, sem concat em axis=1
+                    raw_columns = _achatar_raw_data(df_main['raw_data'].to_numpy(), ignorar=set(df_main.columns))
+                    df_main = pd.DataFrame({
+                        **{col: df_main[col].values for col in df_main.columns if col != 'raw_data'},
+                        **raw_columns
+                    })
+                else:
+                    df_main['raw_data'] = [_serializar_json(valor) for valor in df_main['raw_data'].to_numpy()]
+
+            # Obter análises adicionais
+            stats = stats_future.result()
+            products_analysis = products_future.result()
+            cohort_analysis = cohort_future.result()
+    
         # Criar DataFrames para as análises
         df_stats = pd.DataFrame([stats]) if stats else pd.DataFrame()
         df_products = pd.DataFrame(products_analysis)
         df_cohort = pd.DataFrame(cohort_analysis)
-        
+    
         # Criar arquivo Excel em memória
         output = BytesIO()
-        
+    
+        # DataFrame usado em cada aba, para formatar cada uma com as suas próprias colunas
+        sheet_frames = {'Dados Principais': df_main}
+        if not df_stats.empty:
+            sheet_frames['Estatísticas Gerais'] = df_stats
+        if not df_products.empty:
+            sheet_frames['Análise de Produtos'] = df_products
+        if not df_cohort.empty:
+            sheet_frames['Análise de Cohort'] = df_cohort
+    
         with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            # Aba principal com dados
-            df_main.to_excel(writer, sheet_name='Dados Principais', index=False)
-            
-            # Aba com estatísticas gerais
-            if not df_stats.empty:
-                df_stats.to_excel(writer, sheet_name='Estatísticas Gerais', index=False)
-            
-            # Aba com análise de produtos
-            if not df_products.empty:
-                df_products.to_excel(writer, sheet_name='Análise de Produtos', index=False)
-            
-            # Aba com análise de cohort
-            if not df_cohort.empty:
-                df_cohort.to_excel(writer, sheet_name='Análise de Cohort', index=False)
-            
+            for sheet_name, sheet_df in sheet_frames.items():
+                sheet_df.to_excel(writer, sheet_name=sheet_name, index=False)
+        
             # Acessar workbook para formatação
             workbook = writer.book
-            
-            # Formatos
+        
+            # Formatos (criados uma única vez para todas as abas)
             header_format = workbook.add_format({
                 'bold': True,
                 'text_wrap': True,
@@ -541,38 +913,35 @@ def exportar_xlsx(plataforma=None, start_date=None, end_date=None):
                 'font_color': 'white',
                 'border': 1
             })
-            
+        
             money_format = workbook.add_format({
                 'num_format': 'R$ #,##0.00',
                 'border': 1
             })
-            
-            percent_format = workbook.add_format({
-                'num_format': '0.00%',
-                'border': 1
-            })
-            
+        
+            # Formato por tipo de dado: só colunas float recebem formato monetário
+            dtype_to_format = {'f': money_format}
+        
             # Formatação para cada aba
-            for sheet_name in writer.sheets:
+            for sheet_name, sheet_df in sheet_frames.items():
                 worksheet = writer.sheets[sheet_name]
+            
+                for i, col in enumerate(sheet_df.columns):
+                    # Aplicar formato de cabeçalho
+                    worksheet.write(0, i, col, header_format)
                 
-                # Aplicar formato de cabeçalho
-                for col_num in range(len(writer.sheets[sheet_name].table.columns)):
-                    worksheet.write(0, col_num, writer.sheets[sheet_name].table.columns[col_num], header_format)
-                
-                # Auto-ajustar largura das colunas
-                for i, col in enumerate(writer.sheets[sheet_name].table.columns):
+                    # Auto-ajustar largura das colunas
                     max_len = max(
                         len(str(col)),
                         10  # Largura mínima
                     )
-                    worksheet.set_column(i, i, min(max_len + 2, 50))  # Máximo de 50 caracteres
-                
-                # Adicionar filtros
-                if len(writer.sheets[sheet_name].table.index) > 0:
-                    worksheet.autofilter(0, 0, len(writer.sheets[sheet_name].table.index), 
-                                       len(writer.sheets[sheet_name].table.columns) - 1)
+                    column_format = dtype_to_format.get(sheet_df[col].dtype.kind) if col in MONEY_COLUMNS else None
+                    worksheet.set_column(i, i, min(max_len + 2, 50), column_format)  # Máximo de 50 caracteres
             
+                # Adicionar filtros
+                if len(sheet_df) > 0:
+                    worksheet.autofilter(0, 0, len(sheet_df), len(sheet_df.columns) - 1)
+        
             # Adicionar metadados
             workbook.set_properties({
                 'title': f'Relatório Completo de Webhooks - {datetime.now().strftime("%Y-%m-%d")}',
@@ -581,16 +950,13 @@ def exportar_xlsx(plataforma=None, start_date=None, end_date=None):
                 'company': 'Analytics Dashboard',
                 'comments': f'Período: {start_date} a {end_date}. Plataforma: {plataforma or "Todas"}'
             })
-        
+    
         output.seek(0)
         return output
         
     except Exception as e:
         logger.error(f"Erro ao exportar XLSX: {e}")
         raise
-    finally:
-        if conn:
-            conn.close()
 
 @retry_on_failure()
 def limpar_dados_antigos(dias_retencao=365):
@@ -599,64 +965,162 @@ def limpar_dados_antigos(dias_retencao=365):
     """
     cutoff_date = datetime.now() - timedelta(days=dias_retencao)
     
-    conn = None
     try:
-        conn = get_db_connection()
-        with conn.cursor() as cursor:
-            # Contar registros a serem removidos
-            cursor.execute("SELECT COUNT(*) FROM webhooks WHERE created_at < %s", (cutoff_date,))
-            count_to_delete = cursor.fetchone()[0]
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                # Contar registros a serem removidos
+                cursor.execute("SELECT COUNT(*) FROM webhooks WHERE created_at < %s", (cutoff_date,))
+                count_to_delete = cursor.fetchone()[0]
             
-            if count_to_delete > 0:
-                # Fazer backup dos dados antes de remover (opcional)
-                backup_query = """
-                SELECT * FROM webhooks 
-                WHERE created_at < %s 
-                ORDER BY created_at
-                """
-                cursor.execute(backup_query, (cutoff_date,))
+                if count_to_delete > 0:
+                    # Fazer backup dos dados antes de remover (opcional)
+                    backup_query = """
+                    SELECT * FROM webhooks 
+                    WHERE created_at < %s 
+                    ORDER BY created_at
+                    """
+                    cursor.execute(backup_query, (cutoff_date,))
                 
-                # Remover dados antigos
-                cursor.execute("DELETE FROM webhooks WHERE created_at < %s", (cutoff_date,))
-                conn.commit()
+                    # Remover dados antigos
+                    cursor.execute("DELETE FROM webhooks WHERE created_at < %s", (cutoff_date,))
+                    conn.commit()
                 
-                logger.info(f"✅ Removidos {count_to_delete} registros anteriores a {cutoff_date.strftime('%Y-%m-%d')}")
-                return count_to_delete
-            else:
-                logger.info("ℹ️ Nenhum registro antigo encontrado para remoção")
-                return 0
+                    logger.info(f"✅ Removidos {count_to_delete} registros anteriores a {cutoff_date.strftime('%Y-%m-%d')}")
+                    return count_to_delete
+                else:
+                    logger.info("ℹ️ Nenhum registro antigo encontrado para remoção")
+                    return 0
                 
     except Exception as e:
         logger.error(f"Erro ao limpar dados antigos: {e}")
-        if conn:
-            conn.rollback()
         raise
-    finally:
-        if conn:
-            conn.close()
+
+# Job "running" mais antigo que isso ficou sem dono (worker reiniciado no meio da exportação)
+EXPORT_JOB_TIMEOUT_SECONDS = int(os.getenv("EXPORT_JOB_TIMEOUT_SECONDS", 3600))
+
+@retry_on_failure()
+def registrar_job_exportacao(job_id):
+    """
+    Registra uma exportação agendada em andamento na tabela export_jobs
+    
+    O estado fica no banco para que qualquer worker responda a consulta do job
+    e para sobreviver a reinícios; jobs com mais de 24h são descartados aqui.
+    """
+    aplicar_migracoes()
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("DELETE FROM export_jobs WHERE started_at < NOW() - INTERVAL '24 hours'")
+            cursor.execute(
+                "INSERT INTO export_jobs (job_id, status, started_at) VALUES (%s, 'running', NOW())",
+                (job_id,)
+            )
+        conn.commit()
+
+@retry_on_failure()
+def finalizar_job_exportacao(job_id, status, result=None, error=None):
+    """Grava o resultado (ou o erro) de uma exportação agendada"""
+    result_json = orjson.dumps(result, default=str).decode() if result is not None else None
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                UPDATE export_jobs
+                SET status = %s, result = %s, error = %s, finished_at = NOW()
+                WHERE job_id = %s
+            """, (status, result_json, error, job_id))
+        conn.commit()
+
+@retry_on_failure()
+def obter_job_exportacao(job_id):
+    """
+    Consulta uma exportação agendada das últimas 24h
+    
+    Returns:
+        dict: status, started_at, finished_at e result/error, ou None se não existir
+    """
+    aplicar_migracoes()
+    with get_db_connection(readonly=True) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT
+                    CASE WHEN status = 'running' AND started_at < NOW() - make_interval(secs => %s)
+                         THEN 'interrupted' ELSE status END,
+                    result, error, started_at, finished_at
+                FROM export_jobs
+                WHERE job_id = %s AND started_at >= NOW() - INTERVAL '24 hours'
+            """, (EXPORT_JOB_TIMEOUT_SECONDS, job_id))
+            row = cursor.fetchone()
+    
+    if row is None:
+        return None
+    
+    status, result, error, started_at, finished_at = row
+    job = {
+        "status": status,
+        "started_at": started_at.isoformat() if started_at else None,
+        "finished_at": finished_at.isoformat() if finished_at else None
+    }
+    if result is not None:
+        job["result"] = result
+    if error is not None:
+        job["error"] = error
+    return job
 
 def otimizar_banco():
     """
     Executa operações de otimização no banco de dados
     """
-    conn = None
     try:
-        conn = get_db_connection()
-        with conn.cursor() as cursor:
-            # Atualizar estatísticas das tabelas
-            cursor.execute("ANALYZE webhooks;")
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                # Atualizar estatísticas das tabelas
+                cursor.execute("ANALYZE webhooks;")
             
-            # Reindexar se necessário
-            cursor.execute("REINDEX TABLE webhooks;")
+                # Reindexar se necessário
+                cursor.execute("REINDEX TABLE webhooks;")
             
-            conn.commit()
-            logger.info("✅ Otimização do banco concluída")
+                conn.commit()
+                logger.info("✅ Otimização do banco concluída")
             
     except Exception as e:
         logger.error(f"Erro na otimização do banco: {e}")
-        if conn:
-            conn.rollback()
         raise
-    finally:
-        if conn:
-            conn.close()
\ No newline at end of file
+
+def atualizar_estatisticas_rapidas(idade_maxima=0):
+    """
+    Atualiza a materialized view webhook_stats_24h
+    
+    Chamada pela thread de estatísticas de cada worker; o advisory lock garante um
+    único REFRESH por vez entre workers e instâncias, e quem não obtém o lock segue
+    sem esperar.
+    
+    Args:
+        idade_maxima: Só atualiza se o último refresh tiver mais que isso (segundos)
+    
+    Returns:
+        bool: True se a view foi atualizada
+    """
+    try:
+        with get_db_connection() as conn:
+            # Autocommit: o advisory lock é de sessão e o REFRESH não fica preso a uma transação longa
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT pg_try_advisory_lock(%s)", (_STATS_LOCK_ID,))
+                if not cursor.fetchone()[0]:
+                    return False
+                try:
+                    cursor.execute(
+                        "SELECT refreshed_at < NOW() - make_interval(secs => %s) FROM webhook_stats_24h",
+                        (idade_maxima,)
+                    )
+                    vencida = cursor.fetchone()
+                    if vencida is not None and vencida[0] is False:
+                        return False
+                    cursor.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY webhook_stats_24h;")
+                finally:
+                    cursor.execute("SELECT pg_advisory_unlock(%s)", (_STATS_LOCK_ID,))
+        logger.info("✅ Estatísticas rápidas atualizadas")
+        return True
+
+    except Exception as e:
+        logger.error(f"Erro ao atualizar estatísticas rápidas: {e}")
+        raise
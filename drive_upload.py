@@ -1,23 +1,123 @@
 import json
 import os
 import logging
-from datetime import datetime, timedelta
+import tempfile
+import threading
+from datetime import datetime, timedelta, timezone
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaFileUpload, MediaIoBaseUpload
-from oauth2client.client import OAuth2Credentials
+from google.oauth2.credentials import Credentials
+from google.auth.transport.requests import Request
 from googleapiclient.errors import HttpError
 from io import BytesIO
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+CREDS_FILE = 'mycreds.txt'
+
+# Serviço do Drive reaproveitado por thread (o cliente httplib2 não é thread-safe)
+_drive_local = threading.local()
+
+# Renovação do token e regravação do mycreds.txt, uma thread por vez
+_creds_lock = threading.Lock()
+
 def get_drive_service():
     """
-    Obter serviço do Google Drive com tratamento de erros aprimorado
+    Obter serviço do Google Drive, reaproveitando o já construído enquanto
+    o arquivo de credenciais não for alterado
+    """
+    try:
+        creds_mtime = os.path.getmtime(CREDS_FILE)
+    except OSError:
+        creds_mtime = None
+    
+    cached = getattr(_drive_local, 'service', None)
+    if cached is not None and creds_mtime is not None and cached[2] == creds_mtime:
+        service, creds, _ = cached
+        # Renovar o token apenas quando expirado
+        if creds.expired and creds.refresh_token:
+            _refresh_credentials(creds)
+            _drive_local.service = (service, creds, os.path.getmtime(CREDS_FILE))
+        return service
+    
+    service, creds = _build_drive_service()
+    _drive_local.service = (service, creds, _creds_mtime_after_build(creds_mtime))
+    return service
+
+def _creds_mtime_after_build(creds_mtime):
+    """mtime do arquivo de credenciais após a construção (que pode ter salvo um token novo)"""
+    try:
+        return os.path.getmtime(CREDS_FILE)
+    except OSError:
+        return creds_mtime
+
+def _parse_token_expiry(token_expiry):
+    """Converter o token_expiry salvo no mycreds.txt para datetime UTC sem timezone"""
+    if not token_expiry:
+        return None
+    try:
+        return datetime.strptime(token_expiry.rstrip('Z').split('.')[0], '%Y-%m-%dT%H:%M:%S')
+    except (AttributeError, ValueError):
+        return None
+
+def _refresh_credentials(creds):
+    """
+    Renovar o access token e gravar o novo valor no arquivo de credenciais
+    
+    Serializado entre as threads de upload: quem chega depois reaproveita o token
+    já renovado, e o arquivo é substituído de forma atômica (nunca fica truncado).
+    """
+    with _creds_lock:
+        try:
+            with open(CREDS_FILE, 'r') as f:
+                creds_data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️ Não foi possível ler o arquivo de credenciais: {e}")
+            creds_data = None
+        
+        # Outra thread já renovou enquanto esta esperava o lock
+        stored_expiry = _parse_token_expiry(creds_data.get('token_expiry')) if creds_data else None
+        if (stored_expiry and stored_expiry > datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(minutes=1)
+                and creds_data.get('access_token') != creds.token):
+            creds.token = creds_data['access_token']
+            creds.expiry = stored_expiry
+            return
+        
+        creds.refresh(Request())
+        logger.info("🔑 Token do Google Drive renovado")
+        
+        if creds_data is None:
+            return
+        creds_data['access_token'] = creds.token
+        if creds.expiry:
+            creds_data['token_expiry'] = creds.expiry.strftime('%Y-%m-%dT%H:%M:%SZ')
+        try:
+            _write_creds_atomic(creds_data)
+        except OSError as e:
+            logger.warning(f"⚠️ Não foi possível salvar o token renovado: {e}")
+
+def _write_creds_atomic(creds_data):
+    """Gravar as credenciais num arquivo temporário no mesmo diretório e trocar com os.replace"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(CREDS_FILE)), prefix='.mycreds.')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(creds_data, f)
+        os.replace(tmp_path, CREDS_FILE)
+    except Exception:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def _build_drive_service():
+    """
+    Construir serviço do Google Drive com tratamento de erros aprimorado
     """
     try:
         # Verificar se o arquivo de credenciais existe
-        creds_file = 'mycreds.txt'
+        creds_file = CREDS_FILE
         if not os.path.exists(creds_file):
             logger.error(f"❌ Arquivo de credenciais não encontrado: {creds_file}")
             raise FileNotFoundError(f"Credenciais do Google Drive não encontradas em {creds_file}")
@@ -34,26 +134,28 @@ def get_drive_service():
             raise ValueError(f"Credenciais incompletas. Campos ausentes: {missing_fields}")
 
         # Criar objeto de credenciais
-        creds = OAuth2Credentials(
-            access_token=creds_data['access_token'],
-            client_id=creds_data['client_id'],
-            client_secret=creds_data['client_secret'],
+        creds = Credentials(
+            token=creds_data['access_token'],
             refresh_token=creds_data['refresh_token'],
-            token_expiry=creds_data.get('token_expiry'),
             token_uri=creds_data['token_uri'],
-            user_agent=creds_data.get('user_agent'),
-            revoke_uri=creds_data.get('revoke_uri'),
-            scopes=creds_data.get('scopes', ['https://www.googleapis.com/auth/drive'])
+            client_id=creds_data['client_id'],
+            client_secret=creds_data['client_secret'],
+            scopes=creds_data.get('scopes', ['https://www.googleapis.com/auth/drive']),
+            expiry=_parse_token_expiry(creds_data.get('token_expiry'))
         )
         
+        if creds.expired and creds.refresh_token:
+            _refresh_credentials(creds)
+        
         # Construir serviço
-        service = build('drive', 'v3', credentials=creds)
+        # Documento de discovery embutido na biblioteca: sem requisição HTTP extra
+        service = build('drive', 'v3', credentials=creds, cache_discovery=False, static_discovery=True)
         
         # Teste a conexão fazendo uma chamada simples
         test_response = service.files().list(pageSize=1).execute()
         logger.info("✅ Conexão com Google Drive estabelecida com sucesso")
         
-        return service
+        return service, creds
         
     except FileNotFoundError as e:
         logger.error(f"❌ Arquivo mycreds.txt não encontrado: {e}")
@@ -73,6 +175,14 @@ def get_drive_service():
         logger.error(f"❌ Erro inesperado ao conectar com Google Drive: {e}")
         raise Exception(f"Falha na conexão com Google Drive: {str(e)}")
 
+# IDs das pastas já resolvidas por (nome, pasta pai)
+_folder_ids = {}
+_folder_ids_lock = threading.Lock()
+
+def _escape_query(value):
+    """Escapar barras e aspas simples para uso em consultas q= do Drive"""
+    return str(value).replace('\\', '\\\\').replace("'", "\\'")
+
 def find_file_id_by_name(service, filename, parent_folder_id=None):
     """
     Encontrar ID do arquivo pelo nome no Google Drive
@@ -87,10 +197,10 @@ def find_file_id_by_name(service, filename, parent_folder_id=None):
     """
     try:
         # Construir query de busca
-        query = f"name='{filename}' and trashed=false"
+        query = f"name='{_escape_query(filename)}' and trashed=false"
         
         if parent_folder_id:
-            query += f" and '{parent_folder_id}' in parents"
+            query += f" and '{_escape_query(parent_folder_id)}' in parents"
         
         response = service.files().list(
             q=query,
@@ -127,15 +237,33 @@ def create_folder_if_not_exists(service, folder_name, parent_folder_id=None):
     Returns:
         str or None: ID da pasta criada/encontrada
     """
+    cache_key = (folder_name, parent_folder_id)
+    folder_id = _folder_ids.get(cache_key)
+    if folder_id:
+        return folder_id
+    
+    # Busca + criação sob lock: exportações simultâneas não criam pastas duplicadas
+    with _folder_ids_lock:
+        folder_id = _folder_ids.get(cache_key)
+        if not folder_id:
+            folder_id = _find_or_create_folder(service, folder_name, parent_folder_id)
+            if folder_id:
+                _folder_ids[cache_key] = folder_id
+    return folder_id
+
+def _find_or_create_folder(service, folder_name, parent_folder_id=None):
+    """Buscar a pasta pelo nome e criá-la se não existir"""
     try:
         # Buscar pasta existente
-        query = f"name='{folder_name}' and mimeType='application/vnd.google-apps.folder' and trashed=false"
+        query = f"name='{_escape_query(folder_name)}' and mimeType='application/vnd.google-apps.folder' and trashed=false"
         if parent_folder_id:
-            query += f" and '{parent_folder_id}' in parents"
+            query += f" and '{_escape_query(parent_folder_id)}' in parents"
         
         response = service.files().list(
             q=query,
-            fields="files(id, name)"
+            spaces='drive',
+            fields="files(id)",
+            pageSize=1
         ).execute()
         
         folders = response.get('files', [])
@@ -1,10 +1,25 @@
+import io
+import gzip
+import hashlib
 import json
+import tempfile
+import threading
+import uuid
+import zipfile
+import numpy as np
 import pandas as pd
+import xlsxwriter
 from io import BytesIO
 from datetime import datetime, timedelta
-from flask import Blueprint, request, jsonify, send_file
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from cachetools import TTLCache
+from flask import Blueprint, request, jsonify, send_file, url_for
 from drive_upload import upload_or_replace_file, upload_buffer_to_drive, create_backup_with_rotation
-from db import get_db_connection
+from db import (
+    get_db_connection, consultar_em_lotes, iterar_em_lotes, obter_snapshot_estatisticas,
+    registrar_job_exportacao, finalizar_job_exportacao, obter_job_exportacao
+)
 import logging
 import os
 
@@ -13,13 +28,84 @@ logger = logging.getLogger(__name__)
 
 export_bp = Blueprint("export", __name__)
 
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# Limite de linhas de uma planilha xlsx (1.048.576), descontando o cabeçalho
+EXCEL_MAX_DATA_ROWS = 1_048_575
+
+# constant_memory: cada linha é gravada e liberada assim que a próxima começa
+EXCEL_WORKBOOK_OPTIONS = {
+    'constant_memory': True,
+    'strings_to_urls': False,
+    'strings_to_formulas': False
+}
+
+# Colunas existentes na tabela webhooks (consulta ao information_schema)
+_safe_columns_cache = TTLCache(maxsize=1, ttl=600)
+_safe_columns_lock = threading.Lock()
+
+# Arquivos Excel gerados por conjunto de filtros (limite em bytes). A chave inclui a
+# contagem e o MAX(id) por plataforma: um webhook novo, gravado por qualquer worker,
+# muda a chave sem precisar invalidar o cache de cada processo
+export_cache = TTLCache(maxsize=int(os.getenv("EXPORT_CACHE_MAX_BYTES", 200 * 1024 * 1024)), ttl=900,
+                        getsizeof=lambda item: len(item[1]))
+_export_cache_lock = threading.Lock()
+
+# Teto da janela em dias aceita pelas exportações por período
+EXPORT_MAX_DAYS = int(os.getenv("EXPORT_MAX_DAYS", 730))
+
+# Teto de linhas de uma exportação; acima do limite do Excel ela já sai em ZIP/CSV
+EXPORT_MAX_ROWS = int(os.getenv("EXPORT_MAX_ROWS", 5_000_000))
+
+# Colunas de baixa cardinalidade convertidas para category em prepare_dataframe
+CATEGORICAL_COLUMNS = [
+    'Plataforma', 'Tipo de Evento', 'Nome do Produto', 'Moeda', 'Método de Pagamento',
+    'Status', 'Email Afiliado', 'UTM Source', 'UTM Medium', 'UTM Campaign',
+    'Nome do Atendente', 'Email do Atendente'
+]
+
+# Uploads para o Google Drive rodam fora do ciclo da requisição
+_upload_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="drive_upload")
+
+# Colunas cujo nome sugere data mas que guardam texto/JSON
+NON_DATE_COLUMNS = {'raw_data'}
+
+# Exportações agendadas rodam em segundo plano; o estado fica na tabela export_jobs
+# (visível para todos os workers) e pode ser consultado por 24h
+_scheduled_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="scheduled_export")
+
+def clamp_days(days, default=30):
+    """
+    Limitar a janela em dias das consultas por período
+    
+    Sem teto, um days muito grande transforma a busca por intervalo no índice
+    de created_at em uma leitura da tabela inteira.
+    
+    Args:
+        days: Janela pedida
+        default: Padrão do endpoint, usado quando days não é um inteiro
+    """
+    try:
+        days = int(days)
+    except (TypeError, ValueError):
+        days = default
+    return max(1, min(days, EXPORT_MAX_DAYS))
+
 def get_safe_columns():
     """
     Verificar quais colunas existem na tabela webhooks e retornar apenas as seguras
+    
+    O resultado fica em cache por 10 minutos: o esquema raramente muda e a consulta
+    ao information_schema rodava a cada exportação.
     """
+    with _safe_columns_lock:
+        cached_columns = _safe_columns_cache.get('webhooks')
+    if cached_columns is not None:
+        # Cópia: alguns chamadores acrescentam colunas (ex.: raw_data no backup)
+        return list(cached_columns)
+    
     try:
-        conn = get_db_connection()
-        with conn.cursor() as cursor:
+        with get_db_connection(readonly=True) as conn, conn.cursor() as cursor:
             cursor.execute("""
                 SELECT column_name 
                 FROM information_schema.columns 
@@ -27,7 +113,6 @@ def get_safe_columns():
                 ORDER BY ordinal_position
             """)
             existing_columns = [row[0] for row in cursor.fetchall()]
-        conn.close()
         
         # Colunas básicas que devem existir
         basic_columns = [
@@ -50,7 +135,9 @@ def get_safe_columns():
         safe_columns = [col for col in basic_columns + optional_columns if col in existing_columns]
         
         logger.info(f"✅ Encontradas {len(safe_columns)} colunas seguras na tabela webhooks")
-        return safe_columns
+        with _safe_columns_lock:
+            _safe_columns_cache['webhooks'] = safe_columns
+        return list(safe_columns)
         
     except Exception as e:
         logger.error(f"❌ Erro ao verificar colunas: {e}")
@@ -68,6 +155,9 @@ def fix_timezone_columns(df):
         # Identificar colunas de data
         date_columns = []
         for col in df.columns:
+            # JSON do payload: o nome contém "data" mas não é data, não reprocessar
+            if col in NON_DATE_COLUMNS:
+                continue
             # Verificar se é coluna de data pelo nome
             if any(keyword in col.lower() for keyword in ['date', 'created_at', 'paid_at', 'time', 'expires_at', 'data']):
                 date_columns.append(col)
@@ -80,6 +170,10 @@ def fix_timezone_columns(df):
         # Corrigir cada coluna de data
         for col in date_columns:
             try:
+                # Já convertida em prepare_dataframe: datetime sem timezone não precisa de nova passada
+                if pd.api.types.is_datetime64_dtype(df[col]):
+                    continue
+                
                 original_dtype = str(df[col].dtype)
                 logger.info(f"🔧 Processando coluna: {col} (tipo: {original_dtype})")
                 
@@ -144,84 +238,184 @@ def fix_timezone_columns(df):
         
         return df
 
-def format_excel(writer, df, sheet_name):
+def _content_width(series):
     """
-    Formatar planilha Excel com largura automática das colunas e estilos
+    Estimar a largura do maior valor da coluna sem converter cada célula em string
     
     Args:
-        writer: Objeto ExcelWriter do pandas
-        df: DataFrame para formatar
-        sheet_name: Nome da aba
+        series: Coluna do DataFrame
+    
+    Returns:
+        int: Número de caracteres do maior valor
     """
-    try:
-        workbook = writer.book
-        worksheet = writer.sheets[sheet_name]
-        
-        # Definir formatos
-        header_format = workbook.add_format({
+    if series.empty:
+        return 0
+    
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return 19
+    
+    if pd.api.types.is_bool_dtype(series):
+        return 5
+    
+    if pd.api.types.is_numeric_dtype(series):
+        max_abs = series.abs().max()
+        if pd.isna(max_abs):
+            return 0
+        return int(np.log10(max(1, max_abs))) + 3
+    
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        # Medir só as categorias usadas, não cada linha
+        series = pd.Series(series.cat.remove_unused_categories().cat.categories)
+    
+    non_null = series.dropna()
+    if non_null.empty:
+        return 0
+    
+    # infer_dtype percorre a coluna em C; o acessor .str só mede texto de verdade
+    # (em listas/dicts .str.len() conta elementos, não caracteres)
+    if pd.api.types.infer_dtype(non_null, skipna=True) == 'string':
+        return int(non_null.str.len().max())
+    
+    # Colunas mistas ou sem texto: medir pela representação em string
+    return int(non_null.astype(str).str.len().max())
+
+def create_sheet_formats(workbook):
+    """
+    Criar os formatos das abas uma única vez por workbook
+    
+    Cada add_format registra um novo formato no arquivo: criados por aba, se
+    repetiriam a cada planilha gerada.
+    
+    Args:
+        workbook: Workbook do xlsxwriter
+    
+    Returns:
+        dict: Formatos 'header', 'currency', 'date' e 'text'
+    """
+    return {
+        'header': workbook.add_format({
             'bold': True,
             'text_wrap': True,
             'valign': 'top',
             'fg_color': '#4472C4',
             'font_color': 'white',
             'border': 1
-        })
-        
-        currency_format = workbook.add_format({
+        }),
+        'currency': workbook.add_format({
             'num_format': 'R$ #,##0.00',
             'border': 1
-        })
-        
-        date_format = workbook.add_format({
+        }),
+        'date': workbook.add_format({
             'num_format': 'dd/mm/yyyy hh:mm',
             'border': 1
-        })
-        
-        text_format = workbook.add_format({
+        }),
+        'text': workbook.add_format({
             'text_wrap': True,
             'valign': 'top',
             'border': 1
         })
+    }
+
+def _apply_sheet_formats(worksheet, df, formats):
+    """
+    Aplicar largura automática, formatos por coluna, filtros e congelamento na aba
+    
+    Args:
+        worksheet: Aba do xlsxwriter
+        df: DataFrame com os dados da aba
+        formats: Formatos do workbook (create_sheet_formats)
+    """
+    # Formatar colunas com largura automática
+    for i, col in enumerate(df.columns):
+        # Calcular largura baseada no conteúdo
+        max_len = max(_content_width(df[col]), len(str(col)))
+        
+        # Limitar largura entre 10 e 50 caracteres
+        column_width = min(max(max_len + 2, 10), 50)
+        
+        # Aplicar formatação específica por tipo de coluna
+        col_name = str(col).lower()
+        if 'amount' in col_name or 'valor' in col_name or 'preco' in col_name:
+            # Formatar colunas monetárias
+            worksheet.set_column(i, i, column_width, formats['currency'])
+        elif ('date' in col_name or 'data' in col_name or 'created_at' in col_name
+              or pd.api.types.is_datetime64_any_dtype(df[col])):
+            # Formatar colunas de data
+            worksheet.set_column(i, i, column_width, formats['date'])
+        else:
+            # Formato padrão para texto
+            worksheet.set_column(i, i, column_width, formats['text'])
+    
+    # Adicionar filtros automáticos
+    if len(df) > 0:
+        worksheet.autofilter(0, 0, len(df), len(df.columns) - 1)
+    
+    # Congelar primeira linha (cabeçalhos)
+    worksheet.freeze_panes(1, 0)
+
+def format_excel(writer, df, sheet_name, formats):
+    """
+    Formatar planilha Excel com largura automática das colunas e estilos
+    
+    Args:
+        writer: Objeto ExcelWriter do pandas
+        df: DataFrame para formatar
+        sheet_name: Nome da aba
+        formats: Formatos do workbook (create_sheet_formats(writer.book))
+    """
+    try:
+        worksheet = writer.sheets[sheet_name]
+        _apply_sheet_formats(worksheet, df, formats)
         
         # Formatar cabeçalhos
         for col_num, column in enumerate(df.columns):
-            worksheet.write(0, col_num, column, header_format)
-        
-        # Formatar colunas com largura automática
-        for i, col in enumerate(df.columns):
-            # Calcular largura baseada no conteúdo
-            max_len = max(
-                df[col].astype(str).map(len).max() if len(df) > 0 else 0,
-                len(str(col))
-            )
-            
-            # Limitar largura entre 10 e 50 caracteres
-            column_width = min(max(max_len + 2, 10), 50)
-            worksheet.set_column(i, i, column_width)
-            
-            # Aplicar formatação específica por tipo de coluna
-            if 'amount' in col.lower() or 'valor' in col.lower() or 'preco' in col.lower():
-                # Formatar colunas monetárias
-                worksheet.set_column(i, i, column_width, currency_format)
-            elif 'date' in col.lower() or 'data' in col.lower() or 'created_at' in col.lower():
-                # Formatar colunas de data
-                worksheet.set_column(i, i, column_width, date_format)
-            else:
-                # Formato padrão para texto
-                worksheet.set_column(i, i, column_width, text_format)
-        
-        # Adicionar filtros automáticos
-        if len(df) > 0:
-            worksheet.autofilter(0, 0, len(df), len(df.columns) - 1)
-        
-        # Congelar primeira linha (cabeçalhos)
-        worksheet.freeze_panes(1, 0)
+            worksheet.write(0, col_num, column, formats['header'])
         
         logger.info(f"✅ Formatação aplicada na aba: {sheet_name}")
         
     except Exception as e:
         logger.error(f"❌ Erro ao formatar Excel: {e}")
 
+def write_sheet(workbook, df, sheet_name, formats):
+    """
+    Escrever o DataFrame direto no workbook do xlsxwriter, linha a linha
+    
+    Dispensa o ExcelFormatter do pandas (um objeto por célula) e, como as linhas
+    são escritas em ordem, funciona com o modo constant_memory do xlsxwriter.
+    
+    Args:
+        workbook: Workbook do xlsxwriter
+        df: DataFrame com os dados
+        sheet_name: Nome da aba
+        formats: Formatos do workbook (create_sheet_formats)
+    """
+    worksheet = workbook.add_worksheet(sheet_name)
+    _apply_sheet_formats(worksheet, df, formats)
+    worksheet.write_row(0, 0, [str(col) for col in df.columns], formats['header'])
+    
+    # Método de escrita resolvido uma vez por coluna pelo dtype, evitando o despacho
+    # por tipo do worksheet.write() em cada célula
+    cell_writers = []
+    for col in df.columns:
+        dtype = df[col].dtype
+        if pd.api.types.is_bool_dtype(dtype):
+            cell_writers.append(worksheet.write_boolean)
+        elif pd.api.types.is_numeric_dtype(dtype):
+            cell_writers.append(worksheet.write_number)
+        elif pd.api.types.is_datetime64_any_dtype(dtype):
+            cell_writers.append(worksheet.write_datetime)
+        else:
+            cell_writers.append(worksheet.write)
+    
+    # Valores nativos do Python; NaN/NaT viram células vazias (não são escritas)
+    values = df.astype(object).where(df.notna(), None)
+    for row_num, row in enumerate(values.itertuples(index=False, name=None), start=1):
+        for col_num, value in enumerate(row):
+            if value is not None:
+                cell_writers[col_num](row_num, col_num, value)
+    
+    logger.info(f"✅ Aba escrita: {sheet_name} ({len(df)} registros)")
+
 def prepare_dataframe(data, columns):
     """
     Preparar DataFrame com limpeza e formatação dos dados
@@ -235,7 +429,7 @@ def prepare_dataframe(data, columns):
     """
     try:
         # Criar DataFrame
-        df = pd.DataFrame(data, columns=columns)
+        df = pd.DataFrame.from_records(data, columns=columns)
         
         if df.empty:
             logger.warning("⚠️ DataFrame vazio criado")
@@ -283,16 +477,17 @@ def prepare_dataframe(data, columns):
         for date_col in date_columns:
             if date_col in df.columns:
                 try:
-                    # Converter para datetime
-                    df[date_col] = pd.to_datetime(df[date_col], errors='coerce')
+                    # Converter para datetime uma única vez (o psycopg2 já entrega datetime)
+                    date_series = df[date_col]
+                    if not pd.api.types.is_datetime64_any_dtype(date_series):
+                        date_series = pd.to_datetime(date_series, errors='coerce')
                     
                     # Verificar e remover timezone se presente
-                    if hasattr(df[date_col].dtype, 'tz') and df[date_col].dtype.tz is not None:
+                    if getattr(date_series.dtype, 'tz', None) is not None:
                         logger.info(f"🕐 Removendo timezone da coluna: {date_col}")
-                        df[date_col] = df[date_col].dt.tz_localize(None)
-                    elif 'UTC' in str(df[date_col].dtype) or '+00:00' in str(df[date_col].dtype):
-                        logger.info(f"🕐 Convertendo timezone na coluna: {date_col}")
-                        df[date_col] = df[date_col].dt.tz_localize(None)
+                        date_series = date_series.dt.tz_localize(None)
+                    
+                    df[date_col] = date_series
                         
                 except Exception as date_error:
                     logger.warning(f"⚠️ Problema ao converter data na coluna {date_col}: {date_error}")
@@ -316,6 +511,12 @@ def prepare_dataframe(data, columns):
                 df[text_col] = df[text_col].astype(str).str.strip()
                 df[text_col] = df[text_col].replace(['None', 'nan', 'NaN', ''], None)
         
+        # Colunas com poucos valores distintos viram category (codificação por dicionário):
+        # menos memória que strings object e groupby proporcional aos valores únicos
+        for cat_col in CATEGORICAL_COLUMNS:
+            if cat_col in df.columns and df[cat_col].dtype == 'object':
+                df[cat_col] = df[cat_col].astype('category')
+        
         logger.info(f"✅ DataFrame preparado: {len(df)} registros, {len(df.columns)} colunas")
         return df
         
@@ -323,7 +524,158 @@ def prepare_dataframe(data, columns):
         logger.error(f"❌ Erro ao preparar DataFrame: {e}")
         return pd.DataFrame()
 
-def create_excel_report(data, columns, filename="relatorio_webhooks.xlsx", upload_to_drive=True):
+def create_platform_summary(platform_groups, columns):
+    """
+    Calcular o resumo por plataforma em uma única passada de agregação
+    
+    Args:
+        platform_groups: GroupBy do DataFrame pela coluna de plataforma
+        columns: Colunas disponíveis no DataFrame
+    
+    Returns:
+        DataFrame: Registros, receita total, ticket médio e comissão por plataforma
+    """
+    count_col = 'ID' if 'ID' in columns else columns[0]
+    aggregations = {'Registros': (count_col, 'size')}
+    
+    amount_col = 'Valor' if 'Valor' in columns else ('amount' if 'amount' in columns else None)
+    if amount_col:
+        aggregations['Receita Total'] = (amount_col, 'sum')
+        aggregations['Ticket Médio'] = (amount_col, 'mean')
+    
+    commission_col = 'Comissão' if 'Comissão' in columns else (
+        'commission_amount' if 'commission_amount' in columns else None
+    )
+    if commission_col:
+        aggregations['Comissão Total'] = (commission_col, 'sum')
+    
+    return platform_groups.agg(**aggregations).round(2)
+
+def query_platform_summary(filters_sql, params, columns):
+    """
+    Calcular o resumo por plataforma no banco (GROUP BY), sem trazer as linhas
+    
+    Mesmas colunas e arredondamento de create_platform_summary.
+    
+    Args:
+        filters_sql: Filtros adicionais (" AND ...") aplicados sobre webhooks
+        params: Parâmetros dos filtros
+        columns: Colunas disponíveis na tabela
+    
+    Returns:
+        DataFrame: Registros, receita total, ticket médio e comissão por plataforma
+    """
+    aggregations = ["COUNT(*) AS \"Registros\""]
+    if 'amount' in columns:
+        aggregations.append("ROUND(COALESCE(SUM(amount), 0)::numeric, 2) AS \"Receita Total\"")
+        aggregations.append("ROUND(AVG(amount)::numeric, 2) AS \"Ticket Médio\"")
+    if 'commission_amount' in columns:
+        aggregations.append("ROUND(COALESCE(SUM(commission_amount), 0)::numeric, 2) AS \"Comissão Total\"")
+    
+    summary_columns, rows = consultar_em_lotes(f"""
+        SELECT platform AS "Plataforma", {", ".join(aggregations)}
+        FROM webhooks
+        WHERE 1=1{filters_sql}
+        GROUP BY platform
+        ORDER BY MAX(created_at) DESC
+    """, params)
+    return pd.DataFrame(rows, columns=summary_columns).set_index('Plataforma')
+
+def create_large_export_zip(filters_sql, params, columns, filename="relatorio_webhooks.zip",
+                            max_rows=None, batch_size=100_000):
+    """
+    Criar exportação em ZIP para volumes acima do limite de linhas do Excel
+    
+    O ZIP contém os dados completos em CSV compactado (gzip) e uma planilha
+    pequena com o resumo por plataforma. As linhas vêm do cursor no servidor em
+    lotes de batch_size e cada lote é gravado e descartado antes do próximo.
+    
+    Args:
+        filters_sql: Filtros adicionais (" AND ...") aplicados sobre webhooks
+        params: Parâmetros dos filtros
+        columns: Colunas exportadas
+        filename: Nome do arquivo ZIP
+        max_rows: Teto de linhas exportadas (LIMIT), ou None
+        batch_size: Linhas por lote lido do banco
+    
+    Returns:
+        file: Arquivo temporário em disco com o ZIP gerado (removido ao ser fechado)
+    """
+    base_name = os.path.splitext(filename)[0]
+    query = f"""
+        SELECT {", ".join(columns)}
+        FROM webhooks
+        WHERE 1=1{filters_sql}
+        ORDER BY created_at DESC
+    """
+    query_params = list(params)
+    if max_rows:
+        query += " LIMIT %s"
+        query_params.append(max_rows)
+    
+    total_rows = 0
+    # Em disco e não em memória: o send_file repassa o arquivo em blocos (sendfile)
+    # sem manter o ZIP inteiro no heap durante o download
+    zip_buffer = tempfile.TemporaryFile()
+    # Conteúdo já comprimido (gzip/xlsx): ZIP sem recompressão
+    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_STORED) as zip_file:
+        with zip_file.open(f"{base_name}.csv.gz", 'w') as raw_file, \
+                gzip.GzipFile(fileobj=raw_file, mode='wb') as gzip_file, \
+                io.TextIOWrapper(gzip_file, encoding='utf-8', newline='') as csv_file:
+            for _, rows in iterar_em_lotes(query, query_params, tamanho_lote=batch_size):
+                chunk_df = prepare_dataframe(rows, columns)
+                # Cabeçalho só no primeiro lote
+                chunk_df.to_csv(csv_file, index=False, header=total_rows == 0)
+                total_rows += len(chunk_df)
+        
+        if 'platform' in columns:
+            summary_df = query_platform_summary(filters_sql, params, columns)
+            summary_buffer = BytesIO()
+            with pd.ExcelWriter(summary_buffer, engine='xlsxwriter') as writer:
+                summary_df.to_excel(writer, sheet_name='Resumo', index=True)
+            zip_file.writestr(f"{base_name}_resumo.xlsx", summary_buffer.getvalue())
+    
+    zip_buffer.seek(0)
+    logger.info(f"🗜️ Exportação grande gerada em ZIP: {filename} ({total_rows:,} registros)")
+    return zip_buffer
+
+def _log_upload_result(filename, future):
+    """Registrar o resultado de um upload em segundo plano"""
+    try:
+        upload_result = future.result()
+    except Exception as drive_error:
+        logger.error(f"❌ Erro ao enviar para Google Drive: {drive_error}")
+        return
+    
+    if upload_result.get("success"):
+        logger.info(f"✅ Arquivo enviado para Google Drive: {filename}")
+    else:
+        logger.error(f"❌ Falha no upload para Google Drive: {upload_result.get('error')}")
+
+def upload_excel_in_background(excel_buffer, filename, folder_name="Webhooks_Reports"):
+    """
+    Enviar o arquivo para o Google Drive sem bloquear quem gerou o Excel
+    
+    Args:
+        excel_buffer: Buffer com o arquivo gerado
+        filename: Nome do arquivo no Drive
+        folder_name: Nome da pasta no Drive
+    
+    Returns:
+        Future: Resultado do upload_buffer_to_drive
+    """
+    # Cópia própria: o buffer original segue para o download do cliente
+    future = _upload_executor.submit(
+        upload_buffer_to_drive,
+        buffer=BytesIO(excel_buffer.getvalue()),
+        filename=filename,
+        folder_name=folder_name
+    )
+    future.add_done_callback(partial(_log_upload_result, filename))
+    return future
+
+def create_excel_report(data, columns, filename="relatorio_webhooks.xlsx", upload_to_drive=True,
+                        raise_on_error=False):
     """
     Criar relatório Excel com formatação avançada e upload automático para Google Drive
     
@@ -332,6 +684,8 @@ def create_excel_report(data, columns, filename="relatorio_webhooks.xlsx", uploa
         columns: Colunas do DataFrame
         filename: Nome do arquivo
         upload_to_drive: Se deve fazer upload para o Google Drive
+        raise_on_error: Se True, propaga o erro em vez de devolver a planilha "Erro"
+                        (usado por quem guarda o arquivo em cache)
     
     Returns:
         BytesIO: Buffer com o arquivo Excel gerado
@@ -340,6 +694,10 @@ def create_excel_report(data, columns, filename="relatorio_webhooks.xlsx", uploa
         # Preparar DataFrame
         df = prepare_dataframe(data, columns)
         
+        if df.empty and data and raise_on_error:
+            # prepare_dataframe falhou e devolveu um DataFrame vazio
+            raise ValueError(f"Falha ao preparar {len(data)} registros para o relatório")
+        
         if df.empty:
             logger.warning("⚠️ Nenhum dado para gerar relatório")
             # Criar Excel vazio com cabeçalhos
@@ -351,73 +709,54 @@ def create_excel_report(data, columns, filename="relatorio_webhooks.xlsx", uploa
         # Criar buffer em memória para o arquivo Excel
         excel_buffer = BytesIO()
         
-        with pd.ExcelWriter(excel_buffer, engine='xlsxwriter') as writer:
+        workbook = xlsxwriter.Workbook(excel_buffer, EXCEL_WORKBOOK_OPTIONS)
+        formats = create_sheet_formats(workbook)
+        try:
             # Verificar se deve criar abas separadas por plataforma
             if 'platform' in df.columns or 'Plataforma' in df.columns:
                 platform_col = 'Plataforma' if 'Plataforma' in df.columns else 'platform'
-                unique_platforms = df[platform_col].dropna().unique()
+                # Um único groupby serve tanto para separar as abas quanto para o resumo
+                platform_groups = df.groupby(platform_col, sort=False, observed=True)
                 
-                if len(unique_platforms) > 1:
+                if platform_groups.ngroups > 1:
                     # Criar abas separadas por plataforma
-                    for platform_name in unique_platforms:
-                        platform_df = df[df[platform_col] == platform_name].copy()
+                    for platform_name, platform_df in platform_groups:
                         sheet_name = str(platform_name)[:31]  # Limite do Excel para nomes de aba
                         
-                        platform_df.to_excel(writer, sheet_name=sheet_name, index=False, startrow=0)
-                        format_excel(writer, platform_df, sheet_name)
+                        write_sheet(workbook, platform_df, sheet_name, formats)
                         
                         logger.info(f"📊 Aba criada: {sheet_name} ({len(platform_df)} registros)")
                     
                     # Criar aba com resumo geral
-                    if len(unique_platforms) <= 10:  # Evitar resumos muito grandes
-                        summary_df = df.groupby(platform_col).agg({
-                            'ID' if 'ID' in df.columns else df.columns[0]: 'count',
-                            'Valor' if 'Valor' in df.columns else (
-                                'amount' if 'amount' in df.columns else df.columns[0]
-                            ): ['sum', 'mean', 'count'] if 'Valor' in df.columns or 'amount' in df.columns else 'count'
-                        }).round(2)
+                    if platform_groups.ngroups <= 10:  # Evitar resumos muito grandes
+                        summary_df = create_platform_summary(platform_groups, df.columns)
                         
-                        summary_df.to_excel(writer, sheet_name='Resumo', index=True)
+                        write_sheet(workbook, summary_df.reset_index(), 'Resumo', formats)
                         logger.info(f"📈 Aba de resumo criada")
                 else:
                     # Apenas uma plataforma, criar aba única
-                    df.to_excel(writer, sheet_name='Webhooks', index=False)
-                    format_excel(writer, df, 'Webhooks')
+                    write_sheet(workbook, df, 'Webhooks', formats)
             else:
                 # Sem coluna de plataforma, criar aba única
-                df.to_excel(writer, sheet_name='Webhooks', index=False)
-                format_excel(writer, df, 'Webhooks')
+                write_sheet(workbook, df, 'Webhooks', formats)
+        finally:
+            workbook.close()
         
         excel_buffer.seek(0)
-        file_size = len(excel_buffer.getvalue())
+        file_size = excel_buffer.getbuffer().nbytes
         logger.info(f"✅ Arquivo Excel gerado em memória: {filename} ({file_size:,} bytes)")
         
-        # Upload para Google Drive se solicitado
+        # Upload para Google Drive em segundo plano, sem atrasar a resposta
         if upload_to_drive:
-            try:
-                excel_buffer.seek(0)  # Reset buffer position
-                
-                # Upload direto do buffer
-                upload_result = upload_buffer_to_drive(
-                    buffer=excel_buffer,
-                    filename=filename,
-                    folder_name="Webhooks_Reports"
-                )
-                
-                if upload_result.get("success"):
-                    logger.info(f"✅ Arquivo enviado para Google Drive: {filename}")
-                else:
-                    logger.error(f"❌ Falha no upload para Google Drive: {upload_result.get('error')}")
-                
-            except Exception as drive_error:
-                logger.error(f"❌ Erro ao enviar para Google Drive: {drive_error}")
-                # Continuar mesmo se o upload falhar
+            upload_excel_in_background(excel_buffer, filename)
         
         excel_buffer.seek(0)
         return excel_buffer
         
     except Exception as e:
         logger.error(f"❌ Erro ao criar relatório Excel: {e}")
+        if raise_on_error:
+            raise
         # Retornar buffer vazio em caso de erro
         error_buffer = BytesIO()
         with pd.ExcelWriter(error_buffer, engine='xlsxwriter') as writer:
@@ -426,6 +765,84 @@ def create_excel_report(data, columns, filename="relatorio_webhooks.xlsx", uploa
         error_buffer.seek(0)
         return error_buffer
 
+def create_excel_report_by_platform(query, params, columns, platforms, filename="relatorio_webhooks.xlsx", upload_to_drive=True):
+    """
+    Criar relatório Excel buscando e escrevendo uma plataforma por vez
+    
+    Cada aba vem da sua própria consulta (platform = %s). A plataforma seguinte é
+    buscada em paralelo enquanto a atual é escrita, então só dois DataFrames ficam
+    em memória ao mesmo tempo, em vez do resultado completo.
+    
+    Args:
+        query: SELECT com os filtros já aplicados (sem ORDER BY)
+        params: Parâmetros da consulta
+        columns: Colunas selecionadas
+        platforms: Plataformas na ordem das abas
+        filename: Nome do arquivo
+        upload_to_drive: Se deve fazer upload para o Google Drive
+    
+    Returns:
+        BytesIO: Buffer com o arquivo Excel gerado
+    
+    Raises:
+        Exception: Qualquer falha na geração; nunca devolve a planilha "Erro", então
+                   o resultado pode ir para o cache de exportações
+    """
+    if len(platforms) <= 1 or 'platform' not in columns:
+        # Aba única: mesmo fluxo do relatório completo
+        _, data = consultar_em_lotes(f"{query} ORDER BY created_at DESC", params, explicar=True)
+        return create_excel_report(data, columns, filename, upload_to_drive, raise_on_error=True)
+    
+    platform_query = f"{query} AND platform = %s ORDER BY created_at DESC"
+    
+    def fetch_platform(platform_name):
+        _, data = consultar_em_lotes(platform_query, [*params, platform_name])
+        df = prepare_dataframe(data, columns)
+        if df.empty and data:
+            raise ValueError(f"Falha ao preparar os registros da plataforma {platform_name}")
+        return fix_timezone_columns(df)
+    
+    excel_buffer = BytesIO()
+    summaries = []
+    
+    workbook = xlsxwriter.Workbook(excel_buffer, EXCEL_WORKBOOK_OPTIONS)
+    formats = create_sheet_formats(workbook)
+    try:
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="platform_fetch") as executor:
+            next_future = executor.submit(fetch_platform, platforms[0])
+            for index, platform_name in enumerate(platforms):
+                platform_df = next_future.result()
+                if index + 1 < len(platforms):
+                    next_future = executor.submit(fetch_platform, platforms[index + 1])
+                
+                sheet_name = str(platform_name)[:31]  # Limite do Excel para nomes de aba
+                write_sheet(workbook, platform_df, sheet_name, formats)
+                logger.info(f"📊 Aba criada: {sheet_name} ({len(platform_df)} registros)")
+                
+                # Resumo calculado aba a aba, antes de liberar o DataFrame
+                if len(platforms) <= 10 and not platform_df.empty:
+                    platform_col = 'Plataforma' if 'Plataforma' in platform_df.columns else 'platform'
+                    summaries.append(create_platform_summary(
+                        platform_df.groupby(platform_col, observed=True), platform_df.columns
+                    ))
+                del platform_df
+        
+        if summaries:
+            write_sheet(workbook, pd.concat(summaries).reset_index(), 'Resumo', formats)
+            logger.info("📈 Aba de resumo criada")
+    finally:
+        workbook.close()
+    
+    excel_buffer.seek(0)
+    logger.info(f"✅ Arquivo Excel gerado em memória: {filename} ({excel_buffer.getbuffer().nbytes:,} bytes)")
+    
+    # Upload para Google Drive em segundo plano, sem atrasar a resposta
+    if upload_to_drive:
+        upload_excel_in_background(excel_buffer, filename)
+    
+    excel_buffer.seek(0)
+    return excel_buffer
+
 @export_bp.route("/excel", methods=["GET"])
 def export_excel():
     """
@@ -435,6 +852,9 @@ def export_excel():
         # Parâmetros de filtro
         platform = request.args.get('platform')
         days = request.args.get('days', 30, type=int)
+        # days=0 continua significando "sem filtro de período" (volume limitado por EXPORT_MAX_ROWS)
+        if days:
+            days = clamp_days(days, default=30)
         start_date = request.args.get('start_date')
         end_date = request.args.get('end_date')
         upload_drive = request.args.get('upload_drive', 'true').lower() == 'true'
@@ -449,55 +869,62 @@ def export_excel():
         safe_columns = get_safe_columns()
         columns_str = ", ".join(safe_columns)
         
-        # Construir query SQL dinâmica com colunas seguras
-        query = f"""
-            SELECT 
-                {columns_str}
-            FROM webhooks 
-            WHERE 1=1
-        """
+        # Aplicar filtros dinamicamente
+        filters_sql = ""
         params = []
         
-        # Aplicar filtros dinamicamente
         if platform:
-            query += " AND platform = %s"
+            filters_sql += " AND platform = %s"
             params.append(platform)
         
         if event_type:
-            query += " AND event_type = %s"
+            filters_sql += " AND event_type = %s"
             params.append(event_type)
         
         if status_filter:
-            query += " AND status ILIKE %s"
+            filters_sql += " AND status ILIKE %s"
             params.append(f"%{status_filter}%")
         
         if min_amount is not None:
-            query += " AND amount >= %s"
+            filters_sql += " AND amount >= %s"
             params.append(min_amount)
         
         if max_amount is not None:
-            query += " AND amount <= %s"
+            filters_sql += " AND amount <= %s"
             params.append(max_amount)
         
         # Filtro de data
         if start_date and end_date:
-            query += " AND created_at BETWEEN %s AND %s"
+            filters_sql += " AND created_at BETWEEN %s AND %s"
             params.extend([start_date, end_date])
         elif days:
-            query += " AND created_at >= NOW() - INTERVAL %s DAY"
+            filters_sql += " AND created_at >= NOW() - INTERVAL %s DAY"
             params.append(f'{days}')
         
-        query += " ORDER BY created_at DESC"
+        # Construir query SQL dinâmica com colunas seguras
+        query = f"""
+            SELECT 
+                {columns_str}
+            FROM webhooks 
+            WHERE 1=1{filters_sql}
+        """
+        columns = safe_columns  # Usar as colunas seguras
         
-        # Executar query
-        conn = get_db_connection()
-        with conn.cursor() as cursor:
-            cursor.execute(query, params)
-            data = cursor.fetchall()
-            columns = safe_columns  # Usar as colunas seguras
-        conn.close()
+        # Contagem por plataforma: define as abas (na ordem do evento mais recente), o volume
+        # e, com o MAX(id), a versão dos dados usada na chave do cache
+        with get_db_connection(readonly=True) as conn, conn.cursor() as cursor:
+            cursor.execute(f"""
+                SELECT platform, COUNT(*), MAX(id)
+                FROM webhooks
+                WHERE 1=1{filters_sql}
+                GROUP BY platform
+                ORDER BY MAX(created_at) DESC
+            """, params)
+            platform_counts = cursor.fetchall()
         
-        if not data:
+        total_records = sum(count for _, count, _ in platform_counts)
+        
+        if not total_records:
             logger.warning("⚠️ Nenhum dado encontrado para os filtros especificados")
             return jsonify({
                 "error": "Nenhum dado encontrado para os filtros especificados",
@@ -513,6 +940,33 @@ def export_excel():
                 }
             }), 404
         
+        # Teto de linhas: intervalos explícitos (start_date/end_date) não passam pelo clamp_days
+        if total_records > EXPORT_MAX_ROWS:
+            logger.warning(f"⚠️ {total_records:,} registros excedem o teto de {EXPORT_MAX_ROWS:,} da exportação")
+            return jsonify({
+                "error": "Volume acima do limite da exportação, reduza o período ou aplique filtros",
+                "total_records": total_records,
+                "max_rows": EXPORT_MAX_ROWS
+            }), 413
+        
+        # Mesmos filtros sobre os mesmos dados geram o mesmo arquivo: servir do cache
+        cache_key = hashlib.blake2b(
+            f"{platform}|{days}|{start_date}|{end_date}|{event_type}|{status_filter}|"
+            f"{min_amount}|{max_amount}|{upload_drive}|{platform_counts}".encode(),
+            digest_size=16
+        ).hexdigest()
+        with _export_cache_lock:
+            cached_export = export_cache.get(cache_key)
+        if cached_export:
+            cached_filename, cached_bytes = cached_export
+            logger.info(f"⚡ Exportação servida do cache: {cached_filename}")
+            return send_file(
+                BytesIO(cached_bytes),
+                as_attachment=True,
+                download_name=cached_filename,
+                mimetype=XLSX_MIMETYPE
+            )
+        
         # Gerar nome do arquivo
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         filters_suffix = []
@@ -527,167 +981,266 @@ def export_excel():
         filter_str = "_".join(filters_suffix) if filters_suffix else "todos"
         filename = f"webhooks_report_{filter_str}_{timestamp}.xlsx"
         
-        # Criar Excel
-        excel_buffer = create_excel_report(
-            data=data, 
-            columns=columns, 
+        # Acima do limite de linhas do Excel a planilha seria truncada: entregar CSV compactado
+        if total_records > EXCEL_MAX_DATA_ROWS:
+            logger.warning(f"⚠️ {total_records:,} registros excedem o limite do Excel, exportando em ZIP/CSV")
+            zip_filename = filename.replace('.xlsx', '.zip')
+            zip_buffer = create_large_export_zip(
+                filters_sql=filters_sql,
+                params=params,
+                columns=columns,
+                filename=zip_filename,
+                max_rows=EXPORT_MAX_ROWS
+            )
+            return send_file(
+                zip_buffer,
+                as_attachment=True,
+                download_name=zip_filename,
+                mimetype='application/zip'
+            )
+        
+        # Criar Excel (uma consulta por aba de plataforma)
+        excel_buffer = create_excel_report_by_platform(
+            query=query,
+            params=params,
+            columns=columns,
+            platforms=[platform_name for platform_name, _, _ in platform_counts if platform_name is not None],
             filename=filename,
             upload_to_drive=upload_drive
         )
         
-        logger.info(f"✅ Exportação concluída: {len(data)} registros em {filename}")
+        logger.info(f"✅ Exportação concluída: {total_records} registros em {filename}")
+        
+        # Um único bytes compartilhado entre cache e resposta (BytesIO não copia bytes até ser alterado)
+        excel_bytes = excel_buffer.getvalue()
+        excel_buffer.close()
+        
+        # create_excel_report_by_platform levanta exceção em vez de gerar a planilha "Erro":
+        # só relatórios gerados com sucesso chegam ao cache
+        try:
+            with _export_cache_lock:
+                export_cache[cache_key] = (filename, excel_bytes)
+        except ValueError:
+            # Arquivo maior que o limite do cache
+            pass
         
         # Retornar arquivo para download
         return send_file(
-            excel_buffer,
+            BytesIO(excel_bytes),
             as_attachment=True,
             download_name=filename,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+            mimetype=XLSX_MIMETYPE
         )
         
     except Exception as e:
         logger.error(f"❌ Erro na exportação Excel: {e}")
         return jsonify({"error": str(e)}), 500
 
+def _run_scheduled_export(platform, days, event_types, create_backup):
+    """
+    Executa a exportação agendada em segundo plano: consulta, Excel, upload e backup
+    
+    Returns:
+        dict: Resultado da exportação
+    """
+    # Obter colunas seguras
+    safe_columns = get_safe_columns()
+    
+    # Colunas básicas para exportação agendada
+    scheduled_columns = [col for col in [
+        'id', 'platform', 'event_type', 'webhook_id', 'transaction_id',
+        'customer_email', 'customer_name', 'customer_document',
+        'product_name', 'product_id', 'amount', 'currency', 
+        'payment_method', 'status', 'commission_amount', 
+        'affiliate_email', 'created_at', 'utm_source', 'utm_medium'
+    ] if col in safe_columns]
+    
+    columns_str = ", ".join(scheduled_columns)
+    
+    query = f"""
+        SELECT 
+            {columns_str}
+        FROM webhooks 
+        WHERE created_at >= NOW() - INTERVAL %s DAY
+    """
+    params = [f'{days}']
+    
+    if platform:
+        query += " AND platform = %s"
+        params.append(platform)
+    
+    if event_types:
+        placeholders = ','.join(['%s'] * len(event_types))
+        query += f" AND event_type IN ({placeholders})"
+        params.extend(event_types)
+    
+    query += " ORDER BY created_at DESC"
+    
+    # Executar query
+    _, webhook_data = consultar_em_lotes(query, params)
+    columns = scheduled_columns
+    
+    if not webhook_data:
+        logger.warning("⚠️ Nenhum webhook encontrado para exportação agendada")
+        return {
+            "status": "no_data",
+            "message": "Nenhum webhook encontrado no período especificado",
+            "period_days": days,
+            "platform": platform,
+            "event_types": event_types
+        }
+    
+    # Gerar arquivo
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    platform_suffix = f"_{platform}" if platform else "_scheduled"
+    filename = f"webhooks_scheduled{platform_suffix}_{timestamp}.xlsx"
+    
+    # Criar Excel e enviar para Drive
+    excel_buffer = create_excel_report(
+        data=webhook_data,
+        columns=columns,
+        filename=filename,
+        upload_to_drive=True
+    )
+    
+    result = {
+        "status": "success",
+        "message": "Exportação agendada concluída",
+        "filename": filename,
+        "records_exported": len(webhook_data),
+        "period_days": days,
+        "platform": platform or "todas",
+        "event_types": event_types,
+        "timestamp": timestamp
+    }
+    
+    # Criar backup com rotação se solicitado
+    if create_backup:
+        try:
+            excel_buffer.seek(0)
+            backup_result = create_backup_with_rotation(
+                buffer=excel_buffer,
+                base_filename=f"webhook_backup_{platform or 'all'}",
+                max_backups=10,
+                folder_name="Webhooks_Backups"
+            )
+            
+            if backup_result.get("success"):
+                result["backup"] = {
+                    "created": backup_result.get("backup_created"),
+                    "deleted_old": backup_result.get("backups_deleted", []),
+                    "total_backups": backup_result.get("total_backups")
+                }
+                logger.info(f"🔄 Backup com rotação criado: {backup_result.get('backup_created')}")
+            
+        except Exception as backup_error:
+            logger.error(f"❌ Erro no backup: {backup_error}")
+            result["backup_error"] = str(backup_error)
+    
+    logger.info(f"✅ Exportação agendada concluída: {len(webhook_data)} registros")
+    return result
+
+def _finish_scheduled_job(job_id, future):
+    """
+    Registrar o resultado (ou o erro) de uma exportação agendada concluída
+    """
+    try:
+        job = {"status": "done", "result": future.result()}
+    except Exception as e:
+        logger.error(f"❌ Erro na exportação agendada {job_id}: {e}")
+        job = {"status": "error", "error": str(e)}
+    
+    try:
+        finalizar_job_exportacao(job_id, **job)
+    except Exception as e:
+        logger.error(f"❌ Não foi possível gravar o resultado do job {job_id}: {e}")
+
 @export_bp.route("/excel/scheduled", methods=["POST"])
 def scheduled_export():
     """
     Exportação agendada - apenas upload para Drive sem download
     Ideal para automação e backups programados
+    
+    A geração roda em segundo plano; a resposta 202 traz o job_id
+    para consulta em /excel/scheduled/<job_id>
     """
     try:
         data = request.get_json() or {}
         
         # Parâmetros com valores padrão
         platform = data.get('platform')
-        days = data.get('days', 7)
+        days = clamp_days(data.get('days', 7), default=7)
         event_types = data.get('event_types', [])  # Lista de tipos de evento
         create_backup = data.get('create_backup', False)
         
         logger.info(f"⏰ Exportação agendada iniciada: platform={platform}, days={days}")
         
-        # Obter colunas seguras
-        safe_columns = get_safe_columns()
-        
-        # Colunas básicas para exportação agendada
-        scheduled_columns = [col for col in [
-            'id', 'platform', 'event_type', 'webhook_id', 'transaction_id',
-            'customer_email', 'customer_name', 'customer_document',
-            'product_name', 'product_id', 'amount', 'currency', 
-            'payment_method', 'status', 'commission_amount', 
-            'affiliate_email', 'created_at', 'utm_source', 'utm_medium'
-        ] if col in safe_columns]
-        
-        columns_str = ", ".join(scheduled_columns)
+        job_id = uuid.uuid4().hex
+        registrar_job_exportacao(job_id)
         
-        query = f"""
-            SELECT 
-                {columns_str}
-            FROM webhooks 
-            WHERE created_at >= NOW() - INTERVAL %s DAY
-        """
-        params = [f'{days}']
-        
-        if platform:
-            query += " AND platform = %s"
-            params.append(platform)
-        
-        if event_types:
-            placeholders = ','.join(['%s'] * len(event_types))
-            query += f" AND event_type IN ({placeholders})"
-            params.extend(event_types)
-        
-        query += " ORDER BY created_at DESC"
-        
-        # Executar query
-        conn = get_db_connection()
-        with conn.cursor() as cursor:
-            cursor.execute(query, params)
-            webhook_data = cursor.fetchall()
-            columns = scheduled_columns
-        conn.close()
-        
-        if not webhook_data:
-            logger.warning("⚠️ Nenhum webhook encontrado para exportação agendada")
-            return jsonify({
-                "status": "no_data",
-                "message": "Nenhum webhook encontrado no período especificado",
-                "period_days": days,
-                "platform": platform,
-                "event_types": event_types
-            })
-        
-        # Gerar arquivo
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        platform_suffix = f"_{platform}" if platform else "_scheduled"
-        filename = f"webhooks_scheduled{platform_suffix}_{timestamp}.xlsx"
-        
-        # Criar Excel e enviar para Drive
-        excel_buffer = create_excel_report(
-            data=webhook_data,
-            columns=columns,
-            filename=filename,
-            upload_to_drive=True
-        )
-        
-        result = {
-            "status": "success",
-            "message": "Exportação agendada concluída",
-            "filename": filename,
-            "records_exported": len(webhook_data),
-            "period_days": days,
-            "platform": platform or "todas",
-            "event_types": event_types,
-            "timestamp": timestamp
-        }
-        
-        # Criar backup com rotação se solicitado
-        if create_backup:
-            try:
-                excel_buffer.seek(0)
-                backup_result = create_backup_with_rotation(
-                    buffer=excel_buffer,
-                    base_filename=f"webhook_backup_{platform or 'all'}",
-                    max_backups=10,
-                    folder_name="Webhooks_Backups"
-                )
-                
-                if backup_result.get("success"):
-                    result["backup"] = {
-                        "created": backup_result.get("backup_created"),
-                        "deleted_old": backup_result.get("backups_deleted", []),
-                        "total_backups": backup_result.get("total_backups")
-                    }
-                    logger.info(f"🔄 Backup com rotação criado: {backup_result.get('backup_created')}")
-                
-            except Exception as backup_error:
-                logger.error(f"❌ Erro no backup: {backup_error}")
-                result["backup_error"] = str(backup_error)
+        future = _scheduled_executor.submit(_run_scheduled_export, platform, days, event_types, create_backup)
+        future.add_done_callback(partial(_finish_scheduled_job, job_id))
         
-        logger.info(f"✅ Exportação agendada concluída: {len(webhook_data)} registros")
-        return jsonify(result)
+        return jsonify({
+            "status": "accepted",
+            "message": "Exportação agendada em processamento",
+            "job_id": job_id,
+            "status_url": url_for('export.scheduled_export_status', job_id=job_id)
+        }), 202
         
     except Exception as e:
         logger.error(f"❌ Erro na exportação agendada: {e}")
         return jsonify({"error": str(e)}), 500
 
+@export_bp.route("/excel/scheduled/<job_id>", methods=["GET"])
+def scheduled_export_status(job_id):
+    """
+    Status de uma exportação agendada
+    """
+    try:
+        job = obter_job_exportacao(job_id)
+    except Exception as e:
+        logger.error(f"❌ Erro ao consultar o job {job_id}: {e}")
+        return jsonify({"error": str(e)}), 500
+    
+    if job is None:
+        return jsonify({"error": "Job não encontrado", "job_id": job_id}), 404
+    
+    return jsonify({"job_id": job_id, **job})
+
 @export_bp.route("/stats", methods=["GET"])
 def export_stats():
     """
     Exportar estatísticas detalhadas com múltiplas abas
     """
     try:
-        days = request.args.get('days', 30, type=int)
+        days = clamp_days(request.args.get('days', 30, type=int), default=30)
         upload_drive = request.args.get('upload_drive', 'true').lower() == 'true'
         
         logger.info(f"📈 Iniciando exportação de estatísticas para {days} dias")
         
-        conn = get_db_connection()
-        
         # Dados para múltiplas abas
         excel_data = {}
         
-        with conn.cursor() as cursor:
+        # Transação própria (sem autocommit): a tabela temporária some ao devolver a conexão ao pool
+        with get_db_connection() as conn, conn.cursor() as cursor:
+            # Uma única leitura da janela em webhooks; as cinco agregações rodam sobre ela
+            cursor.execute("""
+                CREATE TEMP TABLE stats_window ON COMMIT DROP AS
+                SELECT platform, product_name, payment_method, affiliate_email, customer_email,
+                       amount, commission_amount, status, created_at
+                FROM webhooks
+                WHERE created_at >= NOW() - INTERVAL %s DAY
+            """, [f'{days}'])
+
+            # Janela vazia: nenhuma agregação nem workbook a montar
+            if cursor.rowcount == 0:
+                logger.warning(f"⚠️ Nenhum webhook nos últimos {days} dias para estatísticas")
+                return jsonify({
+                    "error": "Nenhum dado encontrado para os filtros especificados",
+                    "period_days": days
+                }), 404
+
             # 1. Estatísticas por plataforma
             cursor.execute("""
                 SELECT 
@@ -701,7 +1254,7 @@ def export_stats():
                     COUNT(CASE WHEN status ILIKE '%cancelled%' OR status ILIKE '%cancelado%' OR status ILIKE '%failed%' THEN 1 END) as cancelled_events,
                     MIN(created_at) as first_event,
                     MAX(created_at) as last_event
-                FROM webhooks 
+                FROM stats_window 
                 WHERE created_at >= NOW() - INTERVAL %s DAY
                 GROUP BY platform
                 ORDER BY total_revenue DESC
@@ -720,7 +1273,7 @@ def export_stats():
                     SUM(CASE WHEN amount IS NOT NULL THEN amount ELSE 0 END) as total_revenue,
                     AVG(CASE WHEN amount IS NOT NULL THEN amount ELSE NULL END) as avg_price,
                     COUNT(DISTINCT customer_email) as unique_customers
-                FROM webhooks 
+                FROM stats_window 
                 WHERE created_at >= NOW() - INTERVAL %s DAY
                     AND product_name IS NOT NULL
                     AND product_name != ''
@@ -741,7 +1294,7 @@ def export_stats():
                     COUNT(*) as transactions,
                     SUM(CASE WHEN amount IS NOT NULL THEN amount ELSE 0 END) as total_revenue,
                     AVG(CASE WHEN amount IS NOT NULL THEN amount ELSE NULL END) as avg_amount
-                FROM webhooks 
+                FROM stats_window 
                 WHERE created_at >= NOW() - INTERVAL %s DAY
                     AND payment_method IS NOT NULL
                     AND payment_method != ''
@@ -762,7 +1315,7 @@ def export_stats():
                         COUNT(*) as events,
                         SUM(CASE WHEN amount IS NOT NULL THEN amount ELSE 0 END) as revenue,
                         COUNT(DISTINCT customer_email) as unique_customers
-                    FROM webhooks 
+                    FROM stats_window 
                     WHERE created_at >= NOW() - INTERVAL %s DAY
                     GROUP BY DATE(created_at), platform
                     ORDER BY date DESC, platform
@@ -781,7 +1334,7 @@ def export_stats():
                     SUM(CASE WHEN commission_amount IS NOT NULL THEN commission_amount ELSE 0 END) as total_commission,
                     SUM(CASE WHEN amount IS NOT NULL THEN amount ELSE 0 END) as generated_revenue,
                     AVG(CASE WHEN commission_amount IS NOT NULL THEN commission_amount ELSE NULL END) as avg_commission
-                FROM webhooks 
+                FROM stats_window 
                 WHERE created_at >= NOW() - INTERVAL %s DAY
                     AND affiliate_email IS NOT NULL
                     AND affiliate_email != ''
@@ -795,7 +1348,6 @@ def export_stats():
                 affiliate_columns = [desc[0] for desc in cursor.description]
                 excel_data['Top_Afiliados'] = (affiliate_data, affiliate_columns)
         
-        conn.close()
         
         # Gerar Excel com múltiplas abas
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
@@ -803,35 +1355,22 @@ def export_stats():
         
         excel_buffer = BytesIO()
         
-        with pd.ExcelWriter(excel_buffer, engine='xlsxwriter') as writer:
+        # write_sheet grava linha a linha, o que permite o modo constant_memory
+        with xlsxwriter.Workbook(excel_buffer, EXCEL_WORKBOOK_OPTIONS) as workbook:
+            formats = create_sheet_formats(workbook)
             for sheet_name, (data, columns) in excel_data.items():
                 if data:  # Só criar aba se houver dados
                     df = prepare_dataframe(data, columns)
                     df = fix_timezone_columns(df)  # Corrigir timezone
-                    df.to_excel(writer, sheet_name=sheet_name, index=False)
-                    format_excel(writer, df, sheet_name)
+                    write_sheet(workbook, df, sheet_name, formats)
                     
                     logger.info(f"📊 Aba criada: {sheet_name} ({len(df)} registros)")
         
         excel_buffer.seek(0)
         
-        # Upload para Drive se solicitado
+        # Upload para Drive em segundo plano, se solicitado
         if upload_drive:
-            try:
-                excel_buffer.seek(0)
-                upload_result = upload_buffer_to_drive(
-                    buffer=excel_buffer,
-                    filename=filename,
-                    folder_name="Webhooks_Reports"
-                )
-                
-                if upload_result.get("success"):
-                    logger.info(f"✅ Estatísticas enviadas para Google Drive: {filename}")
-                else:
-                    logger.error(f"❌ Erro no upload: {upload_result.get('error')}")
-                    
-            except Exception as drive_error:
-                logger.error(f"❌ Erro ao enviar estatísticas para Google Drive: {drive_error}")
+            upload_excel_in_background(excel_buffer, filename)
         
         excel_buffer.seek(0)
         
@@ -841,7 +1380,7 @@ def export_stats():
             excel_buffer,
             as_attachment=True,
             download_name=filename,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+            mimetype=XLSX_MIMETYPE
         )
         
     except Exception as e:
@@ -865,8 +1404,7 @@ def create_backup():
         # Se incluir raw_data, adicionar à lista se existir
         if include_raw_data and 'raw_data' not in safe_columns:
             # Verificar se raw_data existe na tabela
-            conn = get_db_connection()
-            with conn.cursor() as cursor:
+            with get_db_connection(readonly=True) as conn, conn.cursor() as cursor:
                 cursor.execute("""
                     SELECT column_name 
                     FROM information_schema.columns 
@@ -874,22 +1412,17 @@ def create_backup():
                 """)
                 if cursor.fetchone():
                     safe_columns.append('raw_data')
-            conn.close()
         
         columns_str = ", ".join(safe_columns)
         
         # Backup apenas para Drive, sem download
-        conn = get_db_connection()
-        with conn.cursor() as cursor:
-            query = f"""
-                SELECT {columns_str}
-                FROM webhooks 
-                ORDER BY created_at DESC
-            """
-            cursor.execute(query)
-            all_data = cursor.fetchall()
-            columns = safe_columns
-        conn.close()
+        query = f"""
+            SELECT {columns_str}
+            FROM webhooks 
+            ORDER BY created_at DESC
+        """
+        _, all_data = consultar_em_lotes(query)
+        columns = safe_columns
         
         if not all_data:
             logger.warning("⚠️ Nenhum dado encontrado para backup")
@@ -961,8 +1494,7 @@ def quick_export():
         
         columns_str = ", ".join(basic_columns)
         
-        conn = get_db_connection()
-        with conn.cursor() as cursor:
+        with get_db_connection(readonly=True) as conn, conn.cursor() as cursor:
             query = f"""
                 SELECT 
                     {columns_str}
@@ -980,7 +1512,6 @@ def quick_export():
             cursor.execute(query, params)
             data = cursor.fetchall()
             columns = basic_columns
-        conn.close()
         
         if not data:
             return jsonify({"error": "Nenhum dado recente encontrado"}), 404
@@ -1000,7 +1531,7 @@ def quick_export():
             excel_buffer,
             as_attachment=True,
             download_name=filename,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+            mimetype=XLSX_MIMETYPE
         )
         
     except Exception as e:
@@ -1022,28 +1553,19 @@ def export_status():
         # Verificar colunas disponíveis
         safe_columns = get_safe_columns()
         
-        # Estatísticas do banco
-        conn = get_db_connection()
-        with conn.cursor() as cursor:
-            cursor.execute("""
-                SELECT 
-                    COUNT(*) as total_webhooks,
-                    COUNT(DISTINCT platform) as platforms,
-                    MIN(created_at) as oldest_record,
-                    MAX(created_at) as newest_record
-                FROM webhooks
-            """)
-            db_stats = cursor.fetchone()
-        conn.close()
+        # Estatísticas do banco (rollup webhook_stats_24h + cache em memória)
+        db_stats = obter_snapshot_estatisticas() or {}
         
         return jsonify({
             "status": "operational",
             "timestamp": datetime.now().isoformat(),
             "database": {
-                "total_webhooks": db_stats[0],
-                "platforms": db_stats[1],
-                "oldest_record": db_stats[2].isoformat() if db_stats[2] else None,
-                "newest_record": db_stats[3].isoformat() if db_stats[3] else None,
+                "total_webhooks": db_stats.get('total_webhooks', 0),
+                "platforms": db_stats.get('platforms', 0),
+                "oldest_record": db_stats['oldest_record'].isoformat() if db_stats.get('oldest_record') else None,
+                "newest_record": db_stats['newest_record'].isoformat() if db_stats.get('newest_record') else None,
+                "events_24h": db_stats.get('events_24h', 0),
+                "revenue_24h": db_stats.get('revenue_24h', 0),
                 "available_columns": len(safe_columns),
                 "columns": safe_columns
             },
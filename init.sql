@@ -26,12 +26,20 @@ CREATE TABLE IF NOT EXISTS webhooks (
 );
 
 -- Criar índices para melhor performance
-CREATE INDEX IF NOT EXISTS idx_webhooks_platform ON webhooks(platform);
 CREATE INDEX IF NOT EXISTS idx_webhooks_created_at ON webhooks(created_at);
 CREATE INDEX IF NOT EXISTS idx_webhooks_transaction_id ON webhooks(transaction_id);
 CREATE INDEX IF NOT EXISTS idx_webhooks_customer_email ON webhooks(customer_email);
 CREATE INDEX IF NOT EXISTS idx_webhooks_affiliate_email ON webhooks(affiliate_email);
 
+-- Índice composto de cobertura para as exportações (filtro por período/plataforma + ORDER BY created_at DESC)
+-- Bancos já existentes recebem este índice por migrations/003_indices_exportacao.sql
+CREATE INDEX IF NOT EXISTS idx_webhooks_created_platform ON webhooks (created_at DESC, platform)
+    INCLUDE (amount, commission_amount, transaction_id, product_name, affiliate_email);
+
+-- Filtro por plataforma + período (abas do /excel, exportações rápidas por plataforma);
+-- também atende o filtro só por plataforma, dispensando um índice em (platform)
+CREATE INDEX IF NOT EXISTS idx_webhooks_platform_created ON webhooks (platform, created_at DESC);
+
 -- Inserir dados de exemplo (opcional)
 INSERT INTO webhooks (
     platform, event_type, transaction_id, customer_email, customer_name,
@@ -53,3 +61,33 @@ INSERT INTO webhooks (
     'Produto Demo 3', 300.00, 'BRL', 'completed', 60.00, 'afiliado3@exemplo.com',
     '{"demo": true}'
 );
+
+-- Rollup com as estatísticas rápidas, compartilhado por todas as instâncias da aplicação.
+-- Atualizado pela thread de estatísticas do app (db.atualizar_estatisticas_rapidas);
+-- bancos criados antes desta view recebem migrations/001_webhook_stats_24h.sql
+CREATE MATERIALIZED VIEW IF NOT EXISTS webhook_stats_24h AS
+SELECT
+    1 AS id,
+    COUNT(*) AS total_webhooks,
+    COUNT(DISTINCT platform) AS platforms,
+    MIN(created_at) AS oldest_record,
+    MAX(created_at) AS newest_record,
+    COUNT(*) FILTER (WHERE created_at >= NOW() - INTERVAL '24 hours') AS events_24h,
+    COALESCE(SUM(amount) FILTER (WHERE created_at >= NOW() - INTERVAL '24 hours'), 0) AS revenue_24h,
+    NOW() AS refreshed_at
+FROM webhooks;
+
+-- Índice único exigido pelo REFRESH ... CONCURRENTLY
+CREATE UNIQUE INDEX IF NOT EXISTS idx_webhook_stats_24h_id ON webhook_stats_24h(id);
+
+-- Estado das exportações agendadas (/api/export/excel/scheduled), compartilhado entre os workers
+CREATE TABLE IF NOT EXISTS export_jobs (
+    job_id VARCHAR(32) PRIMARY KEY,
+    status VARCHAR(20) NOT NULL,
+    result JSONB,
+    error TEXT,
+    started_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_export_jobs_started_at ON export_jobs(started_at);
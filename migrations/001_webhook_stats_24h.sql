@@ -0,0 +1,17 @@
+-- 001_webhook_stats_24h.sql - Rollup das estatísticas rápidas para bancos já existentes
+-- O init.sql só roda em volume novo (docker-entrypoint-initdb.d); o app aplica este
+-- arquivo na inicialização (db.aplicar_migracoes). Idempotente.
+CREATE MATERIALIZED VIEW IF NOT EXISTS webhook_stats_24h AS
+SELECT
+    1 AS id,
+    COUNT(*) AS total_webhooks,
+    COUNT(DISTINCT platform) AS platforms,
+    MIN(created_at) AS oldest_record,
+    MAX(created_at) AS newest_record,
+    COUNT(*) FILTER (WHERE created_at >= NOW() - INTERVAL '24 hours') AS events_24h,
+    COALESCE(SUM(amount) FILTER (WHERE created_at >= NOW() - INTERVAL '24 hours'), 0) AS revenue_24h,
+    NOW() AS refreshed_at
+FROM webhooks;
+
+-- Índice único exigido pelo REFRESH ... CONCURRENTLY
+CREATE UNIQUE INDEX IF NOT EXISTS idx_webhook_stats_24h_id ON webhook_stats_24h(id);
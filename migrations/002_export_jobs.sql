@@ -0,0 +1,12 @@
+-- 002_export_jobs.sql - Estado das exportações agendadas, compartilhado entre os workers
+-- Idempotente; aplicado pelo app na inicialização (db.aplicar_migracoes).
+CREATE TABLE IF NOT EXISTS export_jobs (
+    job_id VARCHAR(32) PRIMARY KEY,
+    status VARCHAR(20) NOT NULL,
+    result JSONB,
+    error TEXT,
+    started_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_export_jobs_started_at ON export_jobs(started_at);
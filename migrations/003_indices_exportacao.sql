@@ -0,0 +1,14 @@
+-- 003_indices_exportacao.sql - Índices compostos das exportações para bancos já existentes
+-- migracao: autocommit
+-- Fora de transação (db.aplicar_migracoes): CONCURRENTLY cria o índice sem bloquear
+-- os INSERTs dos webhooks. Idempotente.
+
+-- Índice composto de cobertura para as exportações (filtro por período/plataforma + ORDER BY created_at DESC)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_webhooks_created_platform ON webhooks (created_at DESC, platform)
+    INCLUDE (amount, commission_amount, transaction_id, product_name, affiliate_email);
+
+-- Filtro por plataforma + período (abas do /excel, exportações rápidas por plataforma)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_webhooks_platform_created ON webhooks (platform, created_at DESC);
+
+-- (platform) é prefixo do índice acima: manter os dois só encarece cada INSERT
+DROP INDEX CONCURRENTLY IF EXISTS idx_webhooks_platform;
@@ -8,21 +8,83 @@ import json
 import os
 import sys
 from datetime import datetime, timedelta
+from functools import lru_cache
+from importlib.util import find_spec
+import httplib2
 from googleapiclient.discovery import build
 from oauth2client.client import OAuth2Credentials
 
+CREDS_FILE = 'mycreds.txt'
+HTTP_TIMEOUT = 30
+
+@lru_cache(maxsize=1)
+def _load_creds():
+    """Lê e decodifica o arquivo de credenciais uma única vez por execução"""
+    with open(CREDS_FILE, 'r') as f:
+        return json.load(f)
+
+def _parse_token_expiry(token_expiry):
+    """Converte o token_expiry salvo (ISO, UTC) no datetime sem timezone esperado pelo oauth2client"""
+    if not token_expiry:
+        return None
+    try:
+        return datetime.strptime(token_expiry.rstrip('Z').split('.')[0], '%Y-%m-%dT%H:%M:%S')
+    except (AttributeError, ValueError):
+        return None
+
+def _save_refreshed_token(credentials):
+    """Grava o access token renovado no arquivo de credenciais, mantendo o formato atual"""
+    creds_data = _load_creds()
+    creds_data['access_token'] = credentials.access_token
+    if credentials.token_expiry:
+        creds_data['token_expiry'] = credentials.token_expiry.strftime('%Y-%m-%dT%H:%M:%SZ')
+    
+    try:
+        with open(CREDS_FILE, 'w') as f:
+            json.dump(creds_data, f)
+        print("🔑 Token renovado e salvo em 'mycreds.txt'")
+    except OSError as e:
+        print(f"⚠️  Aviso: Não foi possível salvar o token renovado: {e}")
+
+@lru_cache(maxsize=1)
+def get_drive_service():
+    """Constrói as credenciais e o serviço do Drive uma única vez e reutiliza nas etapas do script"""
+    creds_data = _load_creds()
+    
+    credentials = OAuth2Credentials(
+        access_token=creds_data['access_token'],
+        client_id=creds_data['client_id'],
+        client_secret=creds_data['client_secret'],
+        refresh_token=creds_data['refresh_token'],
+        token_expiry=_parse_token_expiry(creds_data.get('token_expiry')),
+        token_uri=creds_data['token_uri'],
+        user_agent=creds_data.get('user_agent'),
+        revoke_uri=creds_data.get('revoke_uri'),
+        scopes=creds_data.get('scopes', ['https://www.googleapis.com/auth/drive'])
+    )
+    
+    # Um único Http autorizado: list/create/delete reaproveitam a conexão TLS (keep-alive)
+    http = httplib2.Http(timeout=HTTP_TIMEOUT)
+    
+    # Token vencido: renovar uma vez aqui, em vez de deixar a primeira chamada falhar com 401
+    if credentials.access_token_expired:
+        credentials.refresh(http)
+        _save_refreshed_token(credentials)
+    
+    http = credentials.authorize(http)
+    
+    # Documento de descoberta vem embutido no pacote (static_discovery), sem HTTP extra
+    return build('drive', 'v3', http=http, cache_discovery=False)
+
 def check_credentials_file():
     """Verifica se o arquivo de credenciais existe e está válido"""
-    creds_file = 'mycreds.txt'
-    
-    if not os.path.exists(creds_file):
+    if not os.path.exists(CREDS_FILE):
         print("❌ Arquivo 'mycreds.txt' não encontrado!")
         print("   Certifique-se de que o arquivo está no diretório raiz do projeto.")
         return False
     
     try:
-        with open(creds_file, 'r') as f:
-            creds_data = json.load(f)
+        creds_data = _load_creds()
         
         # Verificar campos obrigatórios
         required_fields = [
@@ -51,25 +113,8 @@ def test_google_drive_connection():
     try:
         print("🔄 Testando conexão com Google Drive...")
         
-        # Carregar credenciais
-        with open('mycreds.txt', 'r') as f:
-            creds_data = json.load(f)
-        
-        # Criar objeto de credenciais
-        credentials = OAuth2Credentials(
-            access_token=creds_data['access_token'],
-            client_id=creds_data['client_id'],
-            client_secret=creds_data['client_secret'],
-            refresh_token=creds_data['refresh_token'],
-            token_expiry=creds_data.get('token_expiry'),
-            token_uri=creds_data['token_uri'],
-            user_agent=creds_data.get('user_agent'),
-            revoke_uri=creds_data.get('revoke_uri'),
-            scopes=creds_data.get('scopes', ['https://www.googleapis.com/auth/drive'])
-        )
-        
-        # Construir serviço
-        service = build('drive', 'v3', credentials=credentials)
+        creds_data = _load_creds()
+        service = get_drive_service()
         
         # Testar com uma operação simples
         results = service.files().list(pageSize=1).execute()
@@ -91,23 +136,7 @@ def create_test_folder():
     try:
         print("🔄 Criando pasta de teste...")
         
-        # Carregar credenciais
-        with open('mycreds.txt', 'r') as f:
-            creds_data = json.load(f)
-        
-        credentials = OAuth2Credentials(
-            access_token=creds_data['access_token'],
-            client_id=creds_data['client_id'],
-            client_secret=creds_data['client_secret'],
-            refresh_token=creds_data['refresh_token'],
-            token_expiry=creds_data.get('token_expiry'),
-            token_uri=creds_data['token_uri'],
-            user_agent=creds_data.get('user_agent'),
-            revoke_uri=creds_data.get('revoke_uri'),
-            scopes=creds_data.get('scopes', ['https://www.googleapis.com/auth/drive'])
-        )
-        
-        service = build('drive', 'v3', credentials=credentials)
+        service = get_drive_service()
         
         # Nome da pasta de teste
         test_folder_name = f"Teste Webhooks - {datetime.now().strftime('%Y%m%d_%H%M%S')}"
@@ -142,23 +171,7 @@ def cleanup_test_folder(folder_id):
         
         print("🔄 Removendo pasta de teste...")
         
-        # Carregar credenciais
-        with open('mycreds.txt', 'r') as f:
-            creds_data = json.load(f)
-        
-        credentials = OAuth2Credentials(
-            access_token=creds_data['access_token'],
-            client_id=creds_data['client_id'],
-            client_secret=creds_data['client_secret'],
-            refresh_token=creds_data['refresh_token'],
-            token_expiry=creds_data.get('token_expiry'),
-            token_uri=creds_data['token_uri'],
-            user_agent=creds_data.get('user_agent'),
-            revoke_uri=creds_data.get('revoke_uri'),
-            scopes=creds_data.get('scopes', ['https://www.googleapis.com/auth/drive'])
-        )
-        
-        service = build('drive', 'v3', credentials=credentials)
+        service = get_drive_service()
         
         # Deletar pasta
         service.files().delete(fileId=folder_id).execute()
@@ -173,20 +186,18 @@ def check_dependencies():
     """Verifica se todas as dependências estão instaladas"""
     print("🔄 Verificando dependências...")
     
-    required_packages = [
-        'google-api-python-client',
-        'oauth2client',
-        'pandas',
-        'flask'
-    ]
+    # Pacote pip -> módulo importável; find_spec só localiza o módulo, sem executá-lo
+    required_packages = {
+        'google-api-python-client': 'googleapiclient',
+        'oauth2client': 'oauth2client',
+        'pandas': 'pandas',
+        'flask': 'flask'
+    }
     
-    missing_packages = []
-    
-    for package in required_packages:
-        try:
-            __import__(package.replace('-', '_'))
-        except ImportError:
-            missing_packages.append(package)
+    missing_packages = [
+        package for package, module in required_packages.items()
+        if find_spec(module) is None
+    ]
     
     if missing_packages:
         print(f"❌ Pacotes ausentes: {', '.join(missing_packages)}")
@@ -1,26 +1,34 @@
-import json
+import orjson
 import pandas as pd
 from io import BytesIO
 from datetime import datetime
-from export_excel import format_excel
+import xlsxwriter
+from export_excel import write_sheet, create_sheet_formats, EXCEL_WORKBOOK_OPTIONS
 
 
 def create_excel_report(data, columns, include_raw_data=True, output_filename="relatorio_teste_multiplas_abas.xlsx"):
     df = pd.DataFrame(data, columns=columns)
-    with pd.ExcelWriter(output_filename, engine='xlsxwriter') as writer:
+    # Remover raw_data uma vez, antes de separar as abas
+    if not include_raw_data and 'raw_data' in df.columns:
+        df = df.drop(columns=['raw_data'])
+    # constant_memory exige escrita linha a linha: write_sheet em vez de df.to_excel,
+    # que grava coluna por coluna e perderia células nesse modo
+    with xlsxwriter.Workbook(output_filename, EXCEL_WORKBOOK_OPTIONS) as workbook:
+        formats = create_sheet_formats(workbook)
         if 'platform' in df.columns:
-            for platform_name, platform_df in df.groupby('platform'):
-                if not include_raw_data:
-                    platform_df = platform_df.drop(columns=['raw_data'])
+            for platform_name, platform_df in df.groupby('platform', sort=False):
                 sheet_name = platform_name[:31] or 'Plataforma'
-                platform_df.to_excel(writer, sheet_name=sheet_name, index=False)
-                format_excel(writer, platform_df, sheet_name)
+                write_sheet(workbook, platform_df, sheet_name, formats)
         else:
-            df.to_excel(writer, sheet_name='Webhooks', index=False)
-            format_excel(writer, df, 'Webhooks')
+            write_sheet(workbook, df, 'Webhooks', formats)
     print(f"✅ Arquivo gerado: {output_filename}")
 
 
+def _dumps(obj):
+    """Serializar raw_data com orjson (mesmo encoder usado em db.py)"""
+    return orjson.dumps(obj).decode()
+
+
 # Simulação de dados
 columns = [
     "platform", "event_type", "webhook_id", "customer_email", "created_at",
@@ -28,10 +36,10 @@ columns = [
 ]
 
 data = [
-    ("Kirvano", "sale", "wh_001", "cliente1@email.com", datetime.now(), 150.0, 30.0, json.dumps({"ip": "192.168.0.1"})),
-    ("Braip", "sale", "wh_002", "cliente2@email.com", datetime.now(), 200.0, 50.0, json.dumps({"ip": "192.168.0.2"})),
-    ("Kirvano", "refund", "wh_003", "cliente3@email.com", datetime.now(), -150.0, -30.0, json.dumps({"ip": "192.168.0.3"})),
-    ("Cakto", "sale", "wh_004", "cliente4@email.com", datetime.now(), 300.0, 60.0, json.dumps({"ip": "192.168.0.4"})),
+    ("Kirvano", "sale", "wh_001", "cliente1@email.com", datetime.now(), 150.0, 30.0, _dumps({"ip": "192.168.0.1"})),
+    ("Braip", "sale", "wh_002", "cliente2@email.com", datetime.now(), 200.0, 50.0, _dumps({"ip": "192.168.0.2"})),
+    ("Kirvano", "refund", "wh_003", "cliente3@email.com", datetime.now(), -150.0, -30.0, _dumps({"ip": "192.168.0.3"})),
+    ("Cakto", "sale", "wh_004", "cliente4@email.com", datetime.now(), 300.0, 60.0, _dumps({"ip": "192.168.0.4"})),
 ]
 
 # Executar
@@ -0,0 +1,99 @@
+# tests/test_buffer.py
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+
+from webhooks._buffer import BufferedSaver
+
+
+def _evento(i):
+    return ("hubla", "sale_approved", {"transaction_id": str(i)})
+
+
+@pytest.fixture
+def lote_mock():
+    """salvar_eventos_lote substituído: registra os lotes recebidos"""
+    with patch('webhooks._buffer.salvar_eventos_lote') as mock_lote:
+        yield mock_lote
+
+
+@pytest.fixture
+def evento_mock():
+    """salvar_evento substituído (caminho síncrono e regravação evento a evento)"""
+    with patch('webhooks._buffer.salvar_evento') as mock_evento:
+        yield mock_evento
+
+
+def _esperar(condicao, timeout=2.0):
+    limite = time.monotonic() + timeout
+    while not condicao():
+        if time.monotonic() > limite:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_lote_gravado_ao_atingir_max_batch(lote_mock, evento_mock):
+    """Lote cheio é gravado sem esperar o prazo"""
+    saver = BufferedSaver(max_batch=3, max_age_ms=60_000)
+    for i in range(3):
+        saver.enqueue(*_evento(i))
+
+    assert _esperar(lambda: lote_mock.call_count == 1)
+    assert lote_mock.call_args.args[0] == [_evento(0), _evento(1), _evento(2)]
+    evento_mock.assert_not_called()
+
+
+def test_lote_gravado_ao_atingir_max_age(lote_mock, evento_mock):
+    """Lote incompleto é gravado quando o evento mais antigo atinge max_age_ms"""
+    saver = BufferedSaver(max_batch=100, max_age_ms=50)
+    saver.enqueue(*_evento(1))
+    saver.enqueue(*_evento(2))
+
+    assert _esperar(lambda: lote_mock.call_count == 1)
+    assert lote_mock.call_args.args[0] == [_evento(1), _evento(2)]
+
+
+def test_fila_cheia_grava_direto(lote_mock, evento_mock):
+    """Com a fila cheia o evento é gravado na hora com salvar_evento"""
+    liberar = threading.Event()
+    lote_mock.side_effect = lambda lote: liberar.wait(2)
+    saver = BufferedSaver(max_batch=1, max_age_ms=0, max_queue=1)
+    try:
+        # Primeiro evento fica preso na gravação, o segundo ocupa a fila
+        saver.enqueue(*_evento(1))
+        assert _esperar(lambda: lote_mock.call_count == 1)
+        saver.enqueue(*_evento(2))
+        saver.enqueue(*_evento(3))
+
+        evento_mock.assert_called_once_with(*_evento(3))
+    finally:
+        liberar.set()
+        # Segundo evento gravado ainda com o mock ativo
+        _esperar(lambda: lote_mock.call_count == 2)
+
+
+def test_falha_no_lote_grava_evento_a_evento(lote_mock, evento_mock):
+    """Erro no INSERT em lote regrava cada evento; um evento inválido não derruba os outros"""
+    lote_mock.side_effect = RuntimeError("falha no lote")
+    evento_mock.side_effect = [None, ValueError("evento inválido"), None]
+    saver = BufferedSaver()
+
+    saver._gravar([_evento(1), _evento(2), _evento(3)])
+
+    assert [c.args for c in evento_mock.call_args_list] == [_evento(1), _evento(2), _evento(3)]
+
+
+def test_flush_grava_pendentes_em_lotes(lote_mock, evento_mock):
+    """flush() esvazia a fila em lotes de até max_batch, sem a thread de fundo"""
+    saver = BufferedSaver(max_batch=2)
+    for i in range(5):
+        saver._queue.put_nowait(_evento(i))
+
+    saver.flush()
+
+    assert [len(c.args[0]) for c in lote_mock.call_args_list] == [2, 2, 1]
+    assert saver.pending() == 0
+    evento_mock.assert_not_called()
@@ -0,0 +1,111 @@
+# tests/test_webhook_signatures.py
+import hashlib
+import hmac
+import json
+from unittest.mock import patch
+
+import pytest
+from flask import Flask
+
+import webhooks.braip as braip
+import webhooks.hubla as hubla
+import webhooks.kirvano as kirvano
+
+SECRET = b"segredo_teste"
+PAYLOAD_BRAIP = json.dumps({"event": "SALE_APPROVED", "transaction": {"id": "T1", "value": 100}}).encode()
+PAYLOAD_HUBLA = json.dumps({"type": "invoice.payment_succeeded", "event": {"invoice": {"id": "H1"}}}).encode()
+PAYLOAD_KIRVANO = json.dumps({"event": "SALE_APPROVED", "sale_id": "K1"}).encode()
+
+
+def _assinar(corpo):
+    return hmac.new(SECRET, corpo, hashlib.sha256).hexdigest()
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """App com os blueprints, segredos de teste e fila de gravação substituída"""
+    monkeypatch.setattr(braip, "BRAIP_SECRET_BYTES", SECRET)
+    monkeypatch.setattr(hubla, "HUBLA_SECRET_BYTES", SECRET)
+    monkeypatch.setattr(kirvano, "KIRVANO_SECRET_BYTES", SECRET)
+
+    app = Flask(__name__)
+    app.config['TESTING'] = True
+    app.register_blueprint(braip.braip_bp, url_prefix="/webhook/braip")
+    app.register_blueprint(hubla.hubla_bp, url_prefix="/webhook/hubla")
+    app.register_blueprint(kirvano.kirvano_bp, url_prefix="/webhook/kirvano")
+
+    with patch('webhooks.braip.enqueue') as braip_enqueue, \
+            patch('webhooks._common.enqueue') as common_enqueue:
+        client = app.test_client()
+        client.braip_enqueue = braip_enqueue
+        client.common_enqueue = common_enqueue
+        yield client
+
+
+def _post(client, url, corpo, header=None, assinatura=None):
+    headers = {header: assinatura} if header else {}
+    return client.post(url, data=corpo, headers=headers, content_type="application/json")
+
+
+def test_braip_sem_assinatura_retorna_403(client):
+    """Braip com segredo configurado recusa requisição sem assinatura"""
+    response = _post(client, "/webhook/braip/", PAYLOAD_BRAIP)
+
+    assert response.status_code == 403
+    assert response.get_json() == {"error": "Assinatura ausente"}
+    client.braip_enqueue.assert_not_called()
+
+
+def test_braip_assinatura_invalida_retorna_403(client):
+    """Braip recusa assinatura que não confere (ou que não é hex)"""
+    for assinatura in (_assinar(b"outro corpo"), "nao-e-hex"):
+        response = _post(client, "/webhook/braip/", PAYLOAD_BRAIP, "X-Braip-Signature", assinatura)
+        assert response.status_code == 403
+        assert response.get_json() == {"error": "Assinatura inválida"}
+    client.braip_enqueue.assert_not_called()
+
+
+def test_braip_assinatura_valida_enfileira(client):
+    """Braip com assinatura válida enfileira o evento e responde 202"""
+    response = _post(client, "/webhook/braip/", PAYLOAD_BRAIP,
+                     "X-Braip-Signature", _assinar(PAYLOAD_BRAIP))
+
+    assert response.status_code == 202
+    plataforma, evento, dados = client.braip_enqueue.call_args.args
+    assert (plataforma, evento) == ("braip", "SALE_APPROVED")
+    assert dados["raw_data"] == PAYLOAD_BRAIP.decode()
+
+
+def test_hubla_sem_assinatura_retorna_403(client):
+    """Hubla com segredo configurado recusa requisição sem assinatura"""
+    response = _post(client, "/webhook/hubla/", PAYLOAD_HUBLA)
+
+    assert response.status_code == 403
+    assert response.get_json() == {"error": "Assinatura ausente"}
+    client.common_enqueue.assert_not_called()
+
+
+def test_hubla_assinatura_invalida_retorna_403(client):
+    """Hubla recusa assinatura que não confere"""
+    response = _post(client, "/webhook/hubla/", PAYLOAD_HUBLA,
+                     "X-Hubla-Signature", _assinar(b"outro corpo"))
+
+    assert response.status_code == 403
+    client.common_enqueue.assert_not_called()
+
+
+def test_hubla_assinatura_valida_enfileira(client):
+    """Hubla com assinatura válida enfileira o evento e responde 202"""
+    response = _post(client, "/webhook/hubla/", PAYLOAD_HUBLA,
+                     "X-Hubla-Signature", _assinar(PAYLOAD_HUBLA))
+
+    assert response.status_code == 202
+    assert client.common_enqueue.call_args.args[0] == "hubla"
+
+
+def test_kirvano_sem_assinatura_aceita(client):
+    """Kirvano só valida a assinatura quando o header vem preenchido"""
+    response = _post(client, "/webhook/kirvano/", PAYLOAD_KIRVANO)
+
+    assert response.status_code == 202
+    assert client.common_enqueue.call_args.args[0] == "kirvano"
@@ -0,0 +1,117 @@
+# webhooks/_buffer.py - Fila em memória para gravação dos webhooks em lote
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from db import salvar_evento, salvar_eventos_lote
+
+# Configuração de logging
+logger = logging.getLogger(__name__)
+
+class BufferedSaver:
+    """
+    Acumula eventos numa fila em memória e grava em lote numa thread de fundo.
+
+    Um lote é gravado ao atingir max_batch eventos ou quando o evento mais antigo
+    do lote espera max_age_ms, o que vier primeiro.
+    """
+
+    def __init__(self, max_batch=200, max_age_ms=250, max_queue=10000):
+        self.max_batch = max_batch
+        self.max_age = max_age_ms / 1000
+        self.max_queue = max_queue
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _start(self):
+        """Inicia a thread de gravação na primeira chamada (uma vez por processo)"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._loop, name="webhook_buffer", daemon=True
+                )
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def enqueue(self, plataforma, tipo, dados):
+        """Enfileira um evento para gravação; com a fila cheia, grava na hora"""
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait((plataforma, tipo, dados))
+        except queue.Full:
+            logger.warning(f"⚠️ Fila de webhooks cheia, gravando {plataforma} - {tipo} direto")
+            salvar_evento(plataforma, tipo, dados)
+
+    def _loop(self):
+        """Coleta lotes da fila e grava no banco"""
+        while True:
+            lote = [self._queue.get()]
+            prazo = time.monotonic() + self.max_age
+            while len(lote) < self.max_batch:
+                restante = prazo - time.monotonic()
+                if restante <= 0:
+                    break
+                try:
+                    lote.append(self._queue.get(timeout=restante))
+                except queue.Empty:
+                    break
+            self._gravar(lote)
+
+    def _gravar(self, lote):
+        """
+        Grava um lote; se o INSERT em lote falhar, tenta evento a evento
+
+        salvar_eventos_lote só levanta exceção até o commit() (nada gravado), então
+        regravar evento a evento não duplica linhas.
+        """
+        try:
+            salvar_eventos_lote(lote)
+            return
+        except Exception as e:
+            logger.error(f"❌ Falha ao gravar lote de {len(lote)} eventos, gravando um a um: {e}")
+
+        # Um evento inválido não derruba o lote inteiro
+        for plataforma, tipo, dados in lote:
+            try:
+                salvar_evento(plataforma, tipo, dados)
+            except Exception as e:
+                # salvar_evento já registra o payload problemático
+                logger.error(f"❌ Evento {plataforma} - {tipo} descartado: {e}")
+
+    def pending(self):
+        """Quantidade aproximada de eventos aguardando gravação"""
+        return self._queue.qsize()
+
+    def flush(self):
+        """Grava tudo o que ainda está na fila (chamado no encerramento do processo)"""
+        lote = []
+        while True:
+            try:
+                lote.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+            if len(lote) >= self.max_batch:
+                self._gravar(lote)
+                lote = []
+        if lote:
+            self._gravar(lote)
+
+# Instância única compartilhada pelos blueprints
+_saver = BufferedSaver()
+
+def enqueue(plataforma, tipo, dados):
+    """Enfileira um evento na instância compartilhada"""
+    _saver.enqueue(plataforma, tipo, dados)
+
+def queue_status():
+    """
+    Profundidade da fila compartilhada, para o health check
+
+    A fila é do processo: cada worker do gunicorn responde com a sua, identificada pelo PID.
+    """
+    return {"scope": "worker", "worker_pid": os.getpid(),
+            "pending": _saver.pending(), "max": _saver.max_queue}
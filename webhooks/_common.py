@@ -0,0 +1,72 @@
+# webhooks/_common.py - Fluxo comum dos webhooks: assinatura -> JSON -> mapeamento -> fila
+import hashlib
+import hmac
+import logging
+import orjson
+from flask import request, jsonify
+from webhooks._buffer import enqueue
+
+# Configuração de logging
+logger = logging.getLogger(__name__)
+
+# Dicionário vazio compartilhado para seções ausentes do payload (somente leitura)
+_EMPTY = {}
+
+def handle_webhook(source, sig_header, secret_bytes, mapper, require_signature=True):
+    """
+    Processa um webhook assinado com HMAC-SHA256 (hex) e enfileira o evento padronizado
+
+    Args:
+        source: Nome da plataforma gravado em webhooks.platform
+        sig_header: Header com a assinatura hex do corpo
+        secret_bytes: Segredo já codificado, ou None para não validar
+        mapper: Função payload -> (evento, dados_padronizados)
+        require_signature: Se False, só valida quando o header vier preenchido
+    """
+    # Corpo lido uma vez direto do stream: usado no HMAC, no parse e em raw_data
+    raw_bytes = request.get_data(cache=False)
+
+    # Validar assinatura se configurada, antes de qualquer parse do JSON
+    if secret_bytes:
+        signature = request.headers.get(sig_header)
+        if signature:
+            # hmac.digest: caminho único em C (OpenSSL); comparação nos 32 bytes do digest
+            expected_signature = hmac.digest(secret_bytes, raw_bytes, 'sha256')
+            try:
+                provided_signature = bytes.fromhex(signature)
+            except ValueError:
+                return jsonify({"error": "Assinatura inválida"}), 403
+
+            if not hmac.compare_digest(provided_signature, expected_signature):
+                return jsonify({"error": "Assinatura inválida"}), 403
+        elif require_signature:
+            return jsonify({"error": "Assinatura ausente"}), 403
+
+    try:
+        payload = orjson.loads(raw_bytes)
+
+        # Extrair e padronizar dados
+        evento, dados = mapper(payload)
+        logger.debug("📥 Webhook %s recebido - Evento: %s", source, evento)
+
+        # Campos aninhados inesperados (payload fora do padrão) são gravados como JSON
+        for key, value in dados.items():
+            if isinstance(value, dict):
+                logger.warning("⚠️ Campo %s do webhook %s veio como dict", key, source)
+                dados[key] = orjson.dumps(value, default=str).decode()
+
+        # Corpo original já é JSON válido (orjson acabou de ler): vai para a coluna
+        # JSONB sem serializar de novo
+        dados['raw_data'] = raw_bytes.decode('utf-8')
+
+        # Enfileira para gravação em lote e responde sem esperar o banco
+        enqueue(source, evento, dados)
+        return jsonify({"status": "accepted", "message": f"Evento {evento} recebido"}), 202
+
+    except Exception as e:
+        # Tamanho e hash identificam o corpo sem despejá-lo no log; o conteúdo só em DEBUG
+        logger.exception("❌ Erro no webhook %s (%d bytes, sha256=%s): %s",
+                         source, len(raw_bytes), hashlib.sha256(raw_bytes).hexdigest(), e)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Corpo recebido: %s", raw_bytes.decode('utf-8', 'replace'))
+        return jsonify({"status": "error", "message": str(e)}), 500
@@ -1,22 +1,51 @@
 # webhooks/braip.py - Missing Braip webhook handler
-import json
 import hmac
-import hashlib
+import orjson
 import os
-from flask import Blueprint, request, jsonify
-from db import salvar_evento
+import re
+import logging
+from flask import Blueprint, Response, request, jsonify
+from webhooks._buffer import enqueue
+from webhooks._common import _EMPTY
+
+# Configuração de logging
+logger = logging.getLogger(__name__)
 
 braip_bp = Blueprint('braip', __name__)
 
+# Segredo já codificado uma única vez (db carrega o .env ao ser importado)
+BRAIP_SECRET_BYTES = (os.getenv("BRAIP_WEBHOOK_SECRET") or "").encode() or None
+
+# Resposta do /test é constante: serializada uma única vez
+_TEST_RESPONSE_BODY = orjson.dumps({
+    "status": "ok",
+    "message": "Braip webhook is working",
+    "endpoint": "/webhook/braip",
+    "auth": {
+        "secret_configured": BRAIP_SECRET_BYTES is not None
+    }
+})
+
+# Formatação monetária removida numa única passada ("R$" e espaços), vírgula decimal vira ponto
+_MONEY_CLEAN = re.compile(r'R\$|\s')
+_MONEY_TABLE = str.maketrans(',', '.')
+
+def _parse_money(value):
+    """Converte um valor monetário em texto ("R$ 10,50") para float, ou None se inválido"""
+    try:
+        return float(_MONEY_CLEAN.sub('', value).translate(_MONEY_TABLE))
+    except ValueError:
+        return None
+
 def extract_braip_data(payload):
     """
     Extrai dados específicos da Braip baseado na estrutura dos webhooks
     """
     # Braip usa estrutura diferente dependendo do tipo de evento
-    transaction = payload.get('transaction', {})
-    product = payload.get('product', {})
-    customer = payload.get('customer', {})
-    affiliate = payload.get('affiliate', {})
+    transaction = payload.get('transaction') or _EMPTY
+    product = payload.get('product') or _EMPTY
+    customer = payload.get('customer') or _EMPTY
+    affiliate = payload.get('affiliate') or _EMPTY
     
     # Extrair valor monetário
     amount = None
@@ -24,20 +53,18 @@ def extract_braip_data(payload):
         # Valor pode vir em centavos ou reais
         raw_value = transaction['value']
         if isinstance(raw_value, str):
-            # Remove formatação monetária
-            clean_value = raw_value.replace('R$', '').replace(' ', '').replace(',', '.')
-            try:
-                amount = float(clean_value)
-            except ValueError:
-                amount = None
+            amount = _parse_money(raw_value)
         elif isinstance(raw_value, (int, float)):
             # Se for número, pode estar em centavos (> 1000) ou reais
             amount = raw_value / 100 if raw_value > 1000 else raw_value
     
+    # Buscas repetidas entre campos resolvidas uma única vez
+    transaction_id = transaction.get('id') or payload.get('transaction_id')
+    
     return {
         # IDs e controle
-        'webhook_id': transaction.get('id') or payload.get('transaction_id'),
-        'transaction_id': transaction.get('id') or payload.get('transaction_id'),
+        'webhook_id': transaction_id,
+        'transaction_id': transaction_id,
         'event_type': payload.get('event') or payload.get('type'),
         
         # Dados do cliente
@@ -92,58 +119,54 @@ def receber_webhook():
     """
     Endpoint para receber webhooks da Braip
     """
-    # Validar assinatura se configurada
-    signature = request.headers.get('X-Braip-Signature')
-    secret = os.getenv("BRAIP_WEBHOOK_SECRET")
+    # Corpo lido uma vez direto do stream (sem guardar em request.data): validado,
+    # decodificado para extrair os campos e guardado em raw_data
+    raw_bytes = request.get_data(cache=False)
     
-    if secret and signature:
-        expected_signature = hmac.new(
-            secret.encode(),
-            request.data,
-            hashlib.sha256
-        ).hexdigest()
-        
-        if not hmac.compare_digest(signature, expected_signature):
+    # Validar assinatura se configurada, antes de qualquer parse do JSON
+    if BRAIP_SECRET_BYTES:
+        signature = request.headers.get('X-Braip-Signature')
+        if not signature:
+            return jsonify({"error": "Assinatura ausente"}), 403
+        
+        # hmac.digest: caminho único em C (OpenSSL), sem montar o objeto HMAC em Python;
+        # a comparação é feita nos 32 bytes do digest, sem formatar o hex esperado
+        expected_signature = hmac.digest(BRAIP_SECRET_BYTES, raw_bytes, 'sha256')
+        try:
+            provided_signature = bytes.fromhex(signature)
+        except ValueError:
+            return jsonify({"error": "Assinatura inválida"}), 403
+        
+        if not hmac.compare_digest(provided_signature, expected_signature):
             return jsonify({"error": "Assinatura inválida"}), 403
 
     try:
-        payload = request.get_json(force=True)
-        
-        # Debug: imprimir estrutura do payload
-        print(f"\n📥 Webhook Braip recebido:")
-        print(f"Event: {payload.get('event') or payload.get('type')}")
-        
-        # Determinar tipo do evento
-        evento = payload.get('event') or payload.get('type') or 'webhook'
+        payload = orjson.loads(raw_bytes)
         
         # Extrair e padronizar dados
         dados_extraidos = extract_braip_data(payload)
         
-        # Converter payload para JSON string
-        dados_extraidos['raw_data'] = json.dumps(payload, ensure_ascii=False, default=str)
+        # Debug: estrutura do payload (formatada só se o nível DEBUG estiver ativo)
+        logger.debug("📥 Webhook Braip recebido - Event: %s", dados_extraidos['event_type'])
         
-        # Debug: verificar se algum campo ainda é dict
-        for key, value in dados_extraidos.items():
-            if isinstance(value, dict):
-                print(f"⚠️  Campo {key} ainda é dict: {value}")
-                dados_extraidos[key] = json.dumps(value)
+        # Determinar tipo do evento (já resolvido na extração)
+        evento = dados_extraidos['event_type'] or 'webhook'
         
-        # Salvar no banco
-        salvar_evento("braip", evento, dados_extraidos)
+        # Payload original já é JSON: reaproveitar os bytes sem serializar de novo
+        dados_extraidos['raw_data'] = raw_bytes.decode('utf-8')
         
-        print(f"✅ Evento Braip {evento} salvo com sucesso!")
+        # Enfileira para gravação em lote: a Braip recebe a resposta sem esperar o INSERT
+        enqueue("braip", evento, dados_extraidos)
         
         return jsonify({
-            "status": "success",
-            "message": f"Evento {evento} processado com sucesso",
+            "status": "accepted",
+            "message": f"Evento {evento} recebido",
             "transaction_id": dados_extraidos.get("transaction_id"),
             "customer_name": dados_extraidos.get("customer_name")
-        }), 200
+        }), 202
         
     except Exception as e:
-        print(f"❌ Erro no webhook Braip: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"❌ Erro no webhook Braip: {e}")
         return jsonify({"status": "error", "message": str(e)}), 500
 
 @braip_bp.route("/test", methods=["GET"])
@@ -151,11 +174,5 @@ def test_webhook():
     """
     Endpoint de teste para verificar se o webhook está funcionando
     """
-    return jsonify({
-        "status": "ok",
-        "message": "Braip webhook is working",
-        "endpoint": "/webhook/braip",
-        "auth": {
-            "secret_configured": bool(os.getenv("BRAIP_WEBHOOK_SECRET"))
-        }
-    })
\ No newline at end of file
+    # Novo Response a cada chamada: hooks after_request (ex.: CORS) alteram os headers
+    return Response(_TEST_RESPONSE_BODY, mimetype='application/json')
\ No newline at end of file
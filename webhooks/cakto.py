@@ -1,7 +1,8 @@
 from flask import Blueprint, request, jsonify
 from db import salvar_evento
+from webhooks._common import _EMPTY
 from dotenv import load_dotenv
-import json
+import orjson
 import os
 import logging
 
@@ -18,76 +19,85 @@ cakto_bp = Blueprint("cakto", __name__)
 WEBHOOK_TOKEN = os.getenv("CAKTO_WEBHOOK_TOKEN")
 WEBHOOK_SECRET = os.getenv("CAKTO_WEBHOOK_SECRET")
 
+def safe_float(value, default=0):
+    """Converte valor para float com segurança"""
+    if value is None:
+        return default
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return default
+
 def extract_cakto_data(payload):
     """
     Função para padronizar dados recebidos do webhook da Cakto.
     Mapeia os campos específicos da Cakto para o formato padrão do banco.
     """
     # Os dados principais estão dentro do objeto 'data'
-    data = payload.get("data", {})
+    data = payload.get("data") or _EMPTY
     
     # Se não há objeto 'data', usa o payload diretamente (compatibilidade)
     if not data:
         data = payload
     
     # Extrai dados do customer
-    customer = data.get("customer", {})
+    customer = data.get("customer") or _EMPTY
     
     # Extrai dados do produto e oferta
-    product = data.get("product", {})
-    offer = data.get("offer", {})
+    product = data.get("product") or _EMPTY
+    offer = data.get("offer") or _EMPTY
     
     # Extrai informações de pagamento específicas
-    card = data.get("card", {})
-    boleto = data.get("boleto", {})
-    pix = data.get("pix", {})
-    picpay = data.get("picpay", {})
+    card = data.get("card") or _EMPTY
+    boleto = data.get("boleto") or _EMPTY
+    pix = data.get("pix") or _EMPTY
+    picpay = data.get("picpay") or _EMPTY
     
     # Extrai primeira comissão se existir
-    commissions = data.get("commissions", [])
-    first_commission = commissions[0] if commissions else {}
-    
-    # Helper function to safely convert to float
-    def safe_float(value, default=0):
-        if value is None:
-            return default
-        try:
-            return float(value)
-        except (ValueError, TypeError):
-            return default
+    commissions = data.get("commissions") or ()
+    first_commission = commissions[0] if commissions else _EMPTY
     
     # Calcula valores com conversão segura para float
     base_amount = safe_float(data.get("baseAmount"))
     discount = safe_float(data.get("discount"))
     
     # Calcula final_amount de forma segura
-    if data.get("amount") is not None:
-        final_amount = safe_float(data.get("amount"))
+    raw_amount = data.get("amount")
+    if raw_amount is not None:
+        final_amount = safe_float(raw_amount)
     elif base_amount > 0:
         final_amount = base_amount - discount
     else:
         final_amount = None
     
+    # Campos usados em mais de uma chave de saída, resolvidos uma única vez
+    order_id = data.get("id")
+    customer_name = customer.get("name") or data.get("customer_name")
+    product_name = product.get("name") or data.get("product_name")
+    checkout_url = data.get("checkoutUrl")
+    created_at = data.get("createdAt") or data.get("created_at")
+    total = safe_float(data.get("total"))
+    
     return {
         # Campos padrão do banco
-        "webhook_id": data.get("id"),
+        "webhook_id": order_id,
         "customer_email": customer.get("email") or data.get("email"),
-        "customer_name": customer.get("name") or data.get("customer_name"),
+        "customer_name": customer_name,
         "customer_document": customer.get("docNumber") or customer.get("document") or data.get("document"),
         "customer_phone": customer.get("phone"),
         
-        "product_name": product.get("name") or data.get("product_name"),
+        "product_name": product_name,
         "product_id": product.get("id") or data.get("product_id"),
         "product_short_id": product.get("short_id"),
         "product_support_email": product.get("supportEmail"),
         "product_type": product.get("type"),
         "invoice_description": product.get("invoiceDescription"),
         
-        "transaction_id": data.get("id") or data.get("transaction_id"),
+        "transaction_id": order_id or data.get("transaction_id"),
         "ref_id": data.get("refId"),
         "parent_order": data.get("parent_order"),
         
-        "amount": final_amount or safe_float(data.get("total")),
+        "amount": final_amount or total,
         "base_amount": base_amount,
         "discount": discount,
         "currency": data.get("currency", "BRL"),
@@ -110,11 +120,11 @@ def extract_cakto_data(payload):
         "offer_type": data.get("offer_type"),
         
         # URLs e links
-        "checkout_url": data.get("checkoutUrl"),
-        "sales_link": data.get("checkoutUrl") or data.get("sales_link"),
+        "checkout_url": checkout_url,
+        "sales_link": checkout_url or data.get("sales_link"),
         
         # Datas
-        "created_at": data.get("createdAt") or data.get("created_at"),
+        "created_at": created_at,
         "paid_at": data.get("paidAt"),
         
         # Informações específicas por método de pagamento
@@ -148,14 +158,14 @@ def extract_cakto_data(payload):
         "attendant_email": data.get("attendant_email"),
         
         # Campos específicos da Cakto (mantidos para compatibilidade)
-        "pedido_id": data.get("id"),
-        "cliente_nome": customer.get("name") or data.get("customer_name"),
-        "produto": product.get("name") or data.get("product_name"),
-        "valor": final_amount or safe_float(data.get("total")) or safe_float(data.get("amount")),
-        "data": data.get("createdAt") or data.get("created_at"),
+        "pedido_id": order_id,
+        "cliente_nome": customer_name,
+        "produto": product_name,
+        "valor": final_amount or total or safe_float(raw_amount),
+        "data": created_at,
         
         # Informações de comissões completas (serializado)
-        "commissions_json": json.dumps(commissions, ensure_ascii=False) if commissions else None,
+        "commissions_json": orjson.dumps(commissions, default=str).decode() if commissions else None,
         "commissions_count": len(commissions),
         
         # Dados de evento
@@ -175,8 +185,8 @@ def receber_webhook():
         return jsonify({"status": "unauthorized"}), 401
 
     try:
-        # Extrai payload JSON enviado pela Cakto
-        payload = request.get_json(force=True)
+        # Extrai payload JSON enviado pela Cakto (corpo lido uma vez, parse com orjson)
+        payload = orjson.loads(request.get_data(cache=False))
         logger.info("📩 Webhook recebido da Cakto.")
         
         # Validação opcional do secret enviado no payload
@@ -185,42 +195,31 @@ def receber_webhook():
             logger.warning("Secret inválido recebido no webhook da Cakto.")
             return jsonify({"status": "unauthorized", "error": "Secret inválido"}), 401
         
-        # Debug: imprimir estrutura do payload
-        print(f"\n📥 Webhook Cakto recebido:")
-        print(f"Event: {payload.get('event') or payload.get('type')}")
-        print(f"Secret: {secret_from_payload[:8]}..." if secret_from_payload else "Sem secret")
-        print(f"Data keys: {list(payload.get('data', {}).keys())}")
-        
-        # Se há dados dentro de 'data', mostrar informações principais
-        data = payload.get('data', {})
-        if data:
-            customer = data.get('customer', {})
-            product = data.get('product', {})
-            print(f"Customer: {customer.get('name', 'N/A')}")
-            print(f"Product: {product.get('name', 'N/A')}")
-            print(f"Amount: {data.get('amount', 'N/A')}")
-            print(f"Status: {data.get('status', 'N/A')}")
-
         # Determina o tipo de evento
         evento = payload.get('event') or payload.get('type') or payload.get('event_type') or 'webhook'
+        
+        # Debug: estrutura do payload, montada só se o nível DEBUG estiver ativo
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("📥 Webhook Cakto recebido - Event: %s, Data keys: %s",
+                         evento, list((payload.get('data') or _EMPTY).keys()))
 
         # Padroniza e salva os dados
         dados_padronizados = extract_cakto_data(payload)
-        dados_padronizados["raw_data"] = json.dumps(payload, ensure_ascii=False)
+        dados_padronizados["raw_data"] = orjson.dumps(payload, default=str).decode()
         
-        # Debug: verificar se algum campo ainda é dict
+        # Campos que vieram como objeto (ex.: affiliate) são gravados como JSON
         dict_fields = []
         for key, value in dados_padronizados.items():
             if isinstance(value, dict):
-                dict_fields.append(f"{key}: {value}")
-                dados_padronizados[key] = json.dumps(value)
+                dict_fields.append(key)
+                dados_padronizados[key] = orjson.dumps(value, default=str).decode()
         
         if dict_fields:
-            print(f"⚠️  Campos convertidos de dict para JSON: {dict_fields}")
+            logger.warning("⚠️ Campos convertidos de dict para JSON: %s", dict_fields)
 
         salvar_evento("cakto", evento, dados_padronizados)
         
-        print(f"✅ Evento {evento} salvo com sucesso!")
+        logger.debug("✅ Evento %s salvo com sucesso!", evento)
 
         return jsonify({
             "status": "success",
@@ -231,9 +230,6 @@ def receber_webhook():
 
     except Exception as e:
         logger.exception("Erro ao processar webhook da Cakto.")
-        print(f"❌ Erro no webhook Cakto: {str(e)}")
-        import traceback
-        traceback.print_exc()
         return jsonify({"status": "error", "message": str(e)}), 500
 
 @cakto_bp.route("/test", methods=["GET"])
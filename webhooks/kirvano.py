@@ -1,12 +1,15 @@
-from flask import Blueprint, request
-from db import salvar_evento
-import hmac
-import hashlib
+from flask import Blueprint
+from webhooks._common import _EMPTY, handle_webhook
 import os
-import json
 
 kirvano_bp = Blueprint('kirvano', __name__)
 
+# Segredo já codificado uma única vez (db carrega o .env ao ser importado)
+KIRVANO_SECRET_BYTES = (os.getenv("KIRVANO_WEBHOOK_SECRET") or "").encode() or None
+
+# Formatação monetária ("R$ 169,80"): 'R', '$' e espaços removidos, vírgula decimal vira ponto
+_MONEY_TABLE = str.maketrans({'R': None, '$': None, ' ': None, ',': '.'})
+
 def extrair_valor_monetario(valor_str):
     """
     Extrai valor numérico de strings monetárias como 'R$ 169,80'
@@ -14,126 +17,112 @@ def extrair_valor_monetario(valor_str):
     if not valor_str:
         return None
     
-    # Remove 'R$', espaços e converte vírgula para ponto
-    valor_limpo = str(valor_str).replace('R$', '').replace(' ', '').replace(',', '.')
+    # Valor já numérico: sem conversão para texto (bool fica de fora, como antes)
+    if type(valor_str) in (int, float):
+        return float(valor_str)
+    
+    # Remove 'R$' e espaços e converte vírgula para ponto numa única passada
+    if not isinstance(valor_str, str):
+        valor_str = str(valor_str)
+    valor_limpo = valor_str.translate(_MONEY_TABLE)
     
     try:
         return float(valor_limpo)
-    except (ValueError, TypeError):
+    except ValueError:
         return None
 
-@kirvano_bp.route("/", methods=["POST"])
-def receber():
-    payload = request.json
+def extract_kirvano_data(payload):
+    """
+    Extrai e padroniza os dados de um webhook da Kirvano
+    """
+    # Extrair dados do customer
+    customer = payload.get('customer') or _EMPTY
+    
+    # Extrair dados do payment
+    payment = payload.get('payment') or _EMPTY
+    
+    # Extrair dados do utm
+    utm = payload.get('utm') or _EMPTY
     
-    # Validação de assinatura (se a Kirvano usar)
-    signature = request.headers.get('X-Kirvano-Signature')
-    secret = os.getenv("KIRVANO_WEBHOOK_SECRET")
+    # Processar produtos - pegar o primeiro produto como principal
+    products = payload.get('products', [])
+    main_product = products[0] if products else _EMPTY
     
-    if secret and signature:
-        expected_signature = hmac.new(
-            secret.encode(),
-            request.data,
-            hashlib.sha256
-        ).hexdigest()
+    # Calcular valor total e comissões se houver
+    total_price_raw = payload.get('total_price')
+    total_amount = extrair_valor_monetario(total_price_raw)
+    
+    # Mapear dados da Kirvano para formato padrão (raw_data é preenchido pelo handler)
+    return {
+        # IDs e controle
+        'webhook_id': payload.get('checkout_id'),
+        'transaction_id': payload.get('sale_id'),
+        'event_type': payload.get('event'),
+        'event_description': payload.get('event_description'),
         
-        if not hmac.compare_digest(signature, expected_signature):
-            return {"error": "Assinatura inválida"}, 403
-
-    try:
-        # Extrair dados do customer
-        customer = payload.get('customer', {})
+        # Dados do cliente
+        'customer_email': customer.get('email'),
+        'customer_name': customer.get('name'),
+        'customer_document': customer.get('document'),
+        'customer_phone': customer.get('phone_number'),
+        
+        # Dados do produto principal
+        'product_name': main_product.get('name'),
+        'product_id': main_product.get('id'),
+        'offer_id': main_product.get('offer_id'),
+        'offer_name': main_product.get('offer_name'),
+        'product_description': main_product.get('description'),
+        'product_photo': main_product.get('photo'),
+        'is_order_bump': main_product.get('is_order_bump'),
         
-        # Extrair dados do payment
-        payment = payload.get('payment', {})
+        # Dados financeiros
+        'amount': total_amount,
+        'total_price_raw': total_price_raw,
+        'currency': 'BRL',  # Assumindo BRL baseado no formato R$
+        'product_price': extrair_valor_monetario(main_product.get('price')),
+        'product_price_raw': main_product.get('price'),
         
-        # Extrair dados do utm
-        utm = payload.get('utm', {})
+        # Dados de pagamento
+        'payment_method': payload.get('payment_method'),
+        'status': payload.get('status'),
+        'type': payload.get('type'),
+        'created_at': payload.get('created_at'),
         
-        # Processar produtos - pegar o primeiro produto como principal
-        products = payload.get('products', [])
-        main_product = products[0] if products else {}
+        # Dados específicos do boleto (se aplicável)
+        'payment_link': payment.get('link'),
+        'digitable_line': payment.get('digitable_line'),
+        'barcode': payment.get('barcode'),
+        'expires_at': payment.get('expires_at'),
         
-        # Calcular valor total e comissões se houver
-        total_price_raw = payload.get('total_price')
-        total_amount = extrair_valor_monetario(total_price_raw)
+        # Dados de UTM
+        'utm_source': utm.get('utm_source'),
+        'utm_medium': utm.get('utm_medium'),
+        'utm_campaign': utm.get('utm_campaign'),
+        'utm_term': utm.get('utm_term'),
+        'utm_content': utm.get('utm_content'),
+        'src': utm.get('src'),
         
-        # Mapear dados da Kirvano para formato padrão
-        dados_padronizados = {
-            # IDs e controle
-            'webhook_id': payload.get('checkout_id'),
-            'transaction_id': payload.get('sale_id'),
-            'event_type': payload.get('event'),
-            'event_description': payload.get('event_description'),
-            
-            # Dados do cliente
-            'customer_email': customer.get('email'),
-            'customer_name': customer.get('name'),
-            'customer_document': customer.get('document'),
-            'customer_phone': customer.get('phone_number'),
-            
-            # Dados do produto principal
-            'product_name': main_product.get('name'),
-            'product_id': main_product.get('id'),
-            'offer_id': main_product.get('offer_id'),
-            'offer_name': main_product.get('offer_name'),
-            'product_description': main_product.get('description'),
-            'product_photo': main_product.get('photo'),
-            'is_order_bump': main_product.get('is_order_bump'),
-            
-            # Dados financeiros
-            'amount': total_amount,
-            'total_price_raw': total_price_raw,
-            'currency': 'BRL',  # Assumindo BRL baseado no formato R$
-            'product_price': extrair_valor_monetario(main_product.get('price')),
-            'product_price_raw': main_product.get('price'),
-            
-            # Dados de pagamento
-            'payment_method': payload.get('payment_method'),
-            'status': payload.get('status'),
-            'type': payload.get('type'),
-            'created_at': payload.get('created_at'),
-            
-            # Dados específicos do boleto (se aplicável)
-            'payment_link': payment.get('link'),
-            'digitable_line': payment.get('digitable_line'),
-            'barcode': payment.get('barcode'),
-            'expires_at': payment.get('expires_at'),
-            
-            # Dados de UTM
-            'utm_source': utm.get('utm_source'),
-            'utm_medium': utm.get('utm_medium'),
-            'utm_campaign': utm.get('utm_campaign'),
-            'utm_term': utm.get('utm_term'),
-            'utm_content': utm.get('utm_content'),
-            'src': utm.get('src'),
-            
-            # Dados de afiliado (se disponível no futuro)
-            'commission_amount': None,  # Não presente neste formato
-            'affiliate_email': None,   # Não presente neste formato
-            
-            # Campo para URL de vendas (se disponível)
-            'sales_link': None,  # Não presente neste formato
-            
-            # Dados dos produtos (array completo serializado)
-            'products_json': json.dumps(products, ensure_ascii=False) if products else None,
-            'products_count': len(products),
-            
-            # Campos extras específicos da Kirvano
-            'checkout_id': payload.get('checkout_id'),
-            'sale_id': payload.get('sale_id'),
-            
-            # Manter payload original para referência
-            'raw_data': json.dumps(payload, ensure_ascii=False, default=str)
-        }
+        # Dados de afiliado (se disponível no futuro)
+        'commission_amount': None,  # Não presente neste formato
+        'affiliate_email': None,   # Não presente neste formato
         
-        # Determinar tipo do evento para salvar
-        event_type = payload.get('event', 'webhook_received')
+        # Campo para URL de vendas (se disponível)
+        'sales_link': None,  # Não presente neste formato
         
-        salvar_evento("kirvano", event_type, dados_padronizados)
-        return {"status": "ok", "message": f"Evento {event_type} processado com sucesso"}
+        # Quantidade de produtos (o array completo fica em raw_data)
+        'products_count': len(products),
         
-    except Exception as e:
-        print(f"❌ Erro ao processar webhook Kirvano: {e}")
-        print(f"Payload recebido: {json.dumps(payload, indent=2, ensure_ascii=False)}")
-        return {"status": "error", "message": str(e)}, 500
\ No newline at end of file
+        # Campos extras específicos da Kirvano
+        'checkout_id': payload.get('checkout_id'),
+        'sale_id': payload.get('sale_id'),
+    }
+
+def _mapear(payload):
+    """Tipo do evento e dados padronizados para o handler comum"""
+    return payload.get('event', 'webhook_received'), extract_kirvano_data(payload)
+
+@kirvano_bp.route("/", methods=["POST"])
+def receber():
+    # Assinatura validada só quando a Kirvano enviar o header
+    return handle_webhook("kirvano", "X-Kirvano-Signature", KIRVANO_SECRET_BYTES, _mapear,
+                          require_signature=False)